@@ -0,0 +1,189 @@
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rich import print
+from spotkin_tools.scripts.fake_spotify import FakeSpotify, install_fake_spotify
+from spotkin_tools.scripts.playlist_cache import PlaylistTrackCache, set_playlist_cache
+from spotkin_tools.scripts.process_job import process_job
+from spotkin_tools.scripts.shared_playlists import SharedPlaylistTracks
+from spotkin_tools.scripts.spotify_client import create_spotify_client, rate_limiter, request_coalescer
+
+
+def make_job(index, sources, quantity, popular_sources, banned_genres):
+    """ A synthetic job whose recipe mixes popular source playlists with ones of its own. """
+    recipe = []
+    for i in range(sources):
+        playlist_id = f"fakepopular{i}" if i < popular_sources else f"fakejob{index}source{i}"
+        recipe.append({
+            "quantity": quantity,
+            "source_playlist_id": playlist_id,
+            "source_playlist_name": playlist_id,
+        })
+    return {
+        "name": f"Benchmark job {index}",
+        "playlist_id": f"faketarget{index}",
+        "description": "Benchmark",
+        "recipe": recipe,
+        "banned_artists": [],
+        "banned_albums": [],
+        "banned_tracks": [],
+        "banned_genres": ["genre 1", "genre 2"] if banned_genres else [],
+        "exceptions_to_banned_genres": [],
+        "ban_skits": True,
+        "banExplicitLyrics": False,
+        "last_tracks": [],
+    }
+
+
+def run_scheduler(args, fake, jobs):
+    """
+    Runs one scheduled tick: the jobs are stored in a throwaway SQLite
+    database, all due this hour, and JobService.process_scheduled_jobs()
+    enqueues and drains them the way a /refresh_jobs run does.
+    """
+    # Each worker gets its own connection, so the database has to be a file:
+    # an in-memory SQLite database is private to one connection
+    database = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}?timeout=30"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["SCHEDULE_SPREAD_MINUTES"] = "1"
+    os.environ["CATCH_UP_HOURS"] = "0"
+    os.environ["SHARE_SOURCE_PLAYLISTS"] = "false" if args.no_shared_playlists else "true"
+
+    from server.src.server import app
+    from server.src.models.models import Ingredient, Job, Token, User, db
+    from server.src.services.job_service import JobService
+    from server.src.services.spotify_service import SpotifyService
+
+    class BenchmarkSpotifyService(SpotifyService):
+        def create_spotify_client(self, token_info, **kwargs):
+            if args.no_coalescing:
+                kwargs["request_coalescer"] = None
+            return super().create_spotify_client(token_info, **kwargs)
+
+    # The app installs the database-backed playlist cache; use the benchmark's
+    set_playlist_cache(PlaylistTrackCache() if args.playlist_cache else None)
+    users = args.users or len(jobs)
+    hour = datetime.datetime.now(datetime.timezone.utc).hour
+
+    with app.app_context():
+        db.create_all()
+        for i in range(users):
+            db.session.add(User(id=f"fakeuser{i}"))
+            db.session.add(Token(user_id=f"fakeuser{i}", token_info={"access_token": f"fake-token-{i}"}))
+        for i, job in enumerate(jobs):
+            db.session.add(Job(
+                user_id=f"fakeuser{i % users}",
+                name=job["name"],
+                target_playlist={"id": job["playlist_id"], "name": job["name"]},
+                scheduled_time=hour,
+                last_updated=int(time.time()),
+                description=job["description"],
+                banned_artists=job["banned_artists"],
+                banned_albums=job["banned_albums"],
+                banned_tracks=job["banned_tracks"],
+                banned_genres=job["banned_genres"],
+                exceptions_to_banned_genres=job["exceptions_to_banned_genres"],
+                ban_skits=job["ban_skits"],
+                banExplicitLyrics=job["banExplicitLyrics"],
+                last_tracks=job["last_tracks"],
+                recipe=[Ingredient(playlist={"id": ingredient["source_playlist_id"],
+                                             "name": ingredient["source_playlist_name"]},
+                                   quantity=ingredient["quantity"])
+                        for ingredient in job["recipe"]],
+            ))
+        db.session.commit()
+
+        job_service = JobService(None, BenchmarkSpotifyService(None, None, None))
+        started = time.time()
+        summary = job_service.process_scheduled_jobs(
+            max_workers=args.workers, max_workers_per_user=args.workers_per_user)
+        elapsed = time.time() - started
+
+    print(f"Scheduled tick: {summary['succeeded']} of {len(jobs)} jobs succeeded for {users} users in {elapsed:.2f}s")
+    print(f"Requests per job: {summary['spotify_calls']['total'] / max(1, summary['total']):.1f}")
+    print(fake.stats())
+    if summary.get("shared_playlists"):
+        print(summary["shared_playlists"])
+    print(summary["request_coalescing"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run process_job (or, with --scheduler, a scheduled tick) against a local fake Spotify API "
+                    "and report timings and request counts.")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4, help="jobs processed at once")
+    parser.add_argument("--sources", type=int, default=8, help="source playlists per job")
+    parser.add_argument("--popular-sources", type=int, default=4,
+                        help="how many of each job's sources every job shares")
+    parser.add_argument("--quantity", type=int, default=5, help="tracks sampled per source")
+    parser.add_argument("--playlist-size", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--requests-per-second", type=float,
+                        help="client-side rate limit (default: SPOTIFY_REQUESTS_PER_SECOND)")
+    parser.add_argument("--unplayable-ratio", type=float, default=0.02)
+    parser.add_argument("--banned-genres", action="store_true", help="give every job genre bans")
+    parser.add_argument("--no-shared-playlists", action="store_true")
+    parser.add_argument("--no-coalescing", action="store_true", help="don't coalesce identical concurrent requests")
+    parser.add_argument("--playlist-cache", action="store_true", help="use an in-memory playlist cache")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="run a scheduled tick through JobService and a throwaway SQLite database")
+    parser.add_argument("--users", type=int, help="users the jobs belong to in --scheduler mode (default: one per job)")
+    parser.add_argument("--workers-per-user", type=int, default=1,
+                        help="jobs of one user processed at once in --scheduler mode")
+    args = parser.parse_args()
+
+    fake = install_fake_spotify(FakeSpotify(
+        playlist_size=args.playlist_size,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+        unplayable_ratio=args.unplayable_ratio,
+    ))
+    if args.requests_per_second:
+        rate_limiter.rate = args.requests_per_second
+        rate_limiter.capacity = rate_limiter.tokens = max(1, int(args.requests_per_second))
+    set_playlist_cache(PlaylistTrackCache() if args.playlist_cache else None)
+    shared_playlists = None if args.no_shared_playlists else SharedPlaylistTracks()
+
+    jobs = [make_job(i, args.sources, args.quantity, args.popular_sources, args.banned_genres)
+            for i in range(args.jobs)]
+    if args.scheduler:
+        run_scheduler(args, fake, jobs)
+        return
+
+    def run(job):
+        if args.no_coalescing:
+            spotify = create_spotify_client("fake-token", request_coalescer=None)
+        else:
+            spotify = create_spotify_client("fake-token")
+        started = time.time()
+        process_job(spotify, job, shared_playlists=shared_playlists)
+        return time.time() - started, spotify.call_counter.total
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(run, jobs))
+    elapsed = time.time() - started
+
+    durations = sorted(duration for duration, _ in results)
+    print(f"{args.jobs} jobs in {elapsed:.2f}s "
+          f"(per job: median {durations[len(durations) // 2]:.2f}s, max {durations[-1]:.2f}s)")
+    print(f"Requests per job: {sum(calls for _, calls in results) / len(results):.1f}")
+    print(fake.stats())
+    if shared_playlists:
+        print(shared_playlists.stats())
+    if not args.no_coalescing:
+        print(request_coalescer.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import time
+from rich import print
+from server.src.server import app
+from server.src.services.data_service import DataService
+from server.src.services.job_service import JobService
+from server.src.services.spotify_service import SpotifyService
+
+# Seconds to wait before checking the queue again when it is empty
+POLL_INTERVAL = int(os.environ.get('JOB_WORKER_POLL_INTERVAL', 30))
+
+
+def work_jobs():
+    """
+    Drain the scheduled job queue forever. Run any number of these next to the
+    web process (e.g. `heroku ps:scale worker=2`); each queued job is claimed by
+    exactly one worker, and jobs whose worker crashed are picked up again once
+    their lease expires.
+    """
+    print("Running job_worker.py to drain the scheduled job queue")
+    job_service = JobService(DataService(), SpotifyService(
+        os.getenv('SPOTIFY_CLIENT_ID'),
+        os.getenv('SPOTIFY_CLIENT_SECRET'),
+        os.getenv('SPOTIFY_REDIRECT_URI')
+    ))
+
+    while True:
+        with app.app_context():
+            summary = job_service.drain_job_queue()
+        if not summary['total']:
+            time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    work_jobs()
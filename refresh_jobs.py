@@ -1,21 +1,51 @@
 import requests
 import os
+import time
 from rich import print
 
+# Seconds between status checks while a run is in progress
+POLL_INTERVAL = int(os.environ.get('REFRESH_JOBS_POLL_INTERVAL', 10))
+# Give up waiting for the run after this many seconds (it keeps running on the server)
+MAX_WAIT = int(os.environ.get('REFRESH_JOBS_MAX_WAIT', 3000))
+REQUEST_TIMEOUT = 30
+# Must match the server's REFRESH_JOBS_SECRET
+HEADERS = {'Authorization': f"Bearer {os.environ.get('REFRESH_JOBS_SECRET', '')}"}
+
 
 def refresh_all_jobs():
     """ To be run as a scheduled job by Heroku scheduler to refresh all jobs """
     print("Running refresh_jobs.py To be run as a scheduled job by Heroku scheduler to refresh all jobs")
     app_url = os.environ.get(
         'APP_URL', 'https://spotkin-1b998975756a.herokuapp.com')
-    response = requests.post(f'{app_url}/refresh_jobs')
+    response = requests.post(f'{app_url}/refresh_jobs', headers=HEADERS, timeout=REQUEST_TIMEOUT)
 
-    if response.status_code == 200:
-        print("Jobs refreshed successfully")
-        print(response.json())
-    else:
+    if response.status_code != 202:
         print(f"Error refreshing jobs: Status {response.status_code}")
         print(response.text)
+        return
+
+    run_id = response.json()['run_id']
+    print(f"Scheduled run {run_id} queued")
+
+    deadline = time.time() + MAX_WAIT
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        response = requests.get(
+            f'{app_url}/refresh_jobs/{run_id}', headers=HEADERS, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            print(f"Error getting run status: Status {response.status_code}")
+            print(response.text)
+            return
+
+        run = response.json()
+        print(
+            f"{run['status']}: {run['scheduled']} scheduled later this hour, {run['queued']} queued, {run['running']} running, "
+            f"{run['succeeded']} succeeded, {run['failed']} failed, {run['skipped']} skipped")
+        if run['status'] in ('finished', 'failed'):
+            print("Jobs refreshed successfully" if run['status'] == 'finished' else f"Run failed: {run['error']}")
+            return
+
+    print(f"Stopped waiting for run {run_id}; it is still running on the server")
 
 
 if __name__ == "__main__":
@@ -1 +1 @@
-from .models import db, User, Job, Token,  Ingredient
+from .models import db, User, Job, JobRun, PlaylistCache, ArtistGenres, Token,  Ingredient
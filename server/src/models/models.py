@@ -51,6 +51,11 @@ class Ingredient(db.Model):
 
 class Job(db.Model):
     __tablename__ = 'jobs'
+    __table_args__ = (
+        # Serves the due-jobs query in JobService.process_scheduled_jobs
+        db.Index('ix_jobs_scheduled_time_last_updated',
+                 'scheduled_time', 'last_updated'),
+    )
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
     last_updated = db.Column(db.Integer, default=int(time.time()))
@@ -72,6 +77,8 @@ class Job(db.Model):
 
     recipe = db.relationship('Ingredient', backref='job',
                              lazy=True, cascade="all, delete-orphan")
+    runs = db.relationship('JobRun', backref='job',
+                           lazy=True, cascade="all, delete-orphan")
 
     def to_dict(self):
         print('Job.to_dict')
@@ -148,6 +155,91 @@ class Job(db.Model):
         return job
 
 
+class JobRun(db.Model):
+    """
+    One scheduled execution of a job, used as a durable work queue.
+
+    A row is created per job and hour slot. Workers claim queued rows (or
+    running rows whose lease has expired) and mark them finished when done.
+    """
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        # A job is enqueued at most once per slot, however many workers enqueue it
+        db.UniqueConstraint('job_id', 'slot', name='uq_job_runs_job_id_slot'),
+        db.Index('ix_job_runs_status_lease_expires_at',
+                 'status', 'lease_expires_at'),
+    )
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    job_id = db.Column(UUID(as_uuid=True),
+                       db.ForeignKey('jobs.id'), nullable=False)
+    user_id = db.Column(db.String, nullable=False)
+    # Id of the scheduled run that enqueued this row
+    run_id = db.Column(db.String, nullable=True, index=True)
+    # Id of the scheduled run whose drain last claimed this row, which may be
+    # a later tick of the same hour
+    claimed_run_id = db.Column(db.String, nullable=True, index=True)
+    # Start of the hour slot (unix seconds) this execution belongs to
+    slot = db.Column(db.Integer, nullable=False)
+    # queued, running, succeeded, failed or skipped
+    status = db.Column(db.String, nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Claimed in ascending order; catch-up runs of missed slots use 1
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    # Earliest time the row may be claimed (unix seconds): the job's minute
+    # within the hour, or the end of its retry backoff
+    next_attempt_at = db.Column(db.Integer, nullable=True)
+    lease_owner = db.Column(db.String, nullable=True)
+    lease_expires_at = db.Column(db.Integer, nullable=True)
+    enqueued_at = db.Column(db.Integer, default=lambda: int(time.time()))
+    started_at = db.Column(db.Integer, nullable=True)
+    finished_at = db.Column(db.Integer, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)
+    message = db.Column(db.String, nullable=True)
+    # Spotify status code of the last failed attempt
+    http_status = db.Column(db.Integer, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'job_id': str(self.job_id),
+            'user_id': self.user_id,
+            'run_id': self.run_id,
+            'claimed_run_id': self.claimed_run_id,
+            'slot': self.slot,
+            'status': self.status,
+            'attempts': self.attempts,
+            'priority': self.priority,
+            'next_attempt_at': self.next_attempt_at,
+            'enqueued_at': self.enqueued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_seconds': self.duration_seconds,
+            'message': self.message,
+            'http_status': self.http_status,
+        }
+
+
+class PlaylistCache(db.Model):
+    """
+    Items of a source playlist as of `snapshot_id`, so unchanged playlists
+    don't have to be paged through again (see DbPlaylistTrackCache).
+    """
+    __tablename__ = 'playlist_cache'
+    playlist_id = db.Column(db.String, primary_key=True)
+    snapshot_id = db.Column(db.String, nullable=False)
+    items = db.Column(JSON, nullable=False)
+    updated_at = db.Column(db.Integer, default=lambda: int(time.time()),
+                           onupdate=lambda: int(time.time()))
+
+
+class ArtistGenres(db.Model):
+    """ Spotify genres of an artist as of `fetched_at` (see DbArtistGenreStore). """
+    __tablename__ = 'artist_genres'
+    artist_id = db.Column(db.String, primary_key=True)
+    genres = db.Column(JSON, nullable=False)
+    fetched_at = db.Column(db.Integer, nullable=False)
+
+
 class Token(db.Model):
     __tablename__ = 'tokens'
     user_id = db.Column(db.String, db.ForeignKey('users.id'), primary_key=True)
@@ -1,13 +1,28 @@
-import requests
-from flask import json, jsonify, request, redirect
+import hmac
+import time
+from flask import Response, json, jsonify, request, redirect, stream_with_context
 from server.database.database import db
 from sqlalchemy import text
 from server.src.models.models import Job, Token, User
 from server.src.services.spotify_service import SpotifyService
 from server.src.services.job_service import JobService
+from spotipy.exceptions import SpotifyException
+from spotkin_tools.scripts.spotify_client import create_spotify_client
 import os
 import jwt
 
+# Shared secret the scheduler sends as `Authorization: Bearer <secret>` to
+# start scheduled runs and read their status
+REFRESH_JOBS_SECRET = os.environ.get('REFRESH_JOBS_SECRET')
+
+
+def has_scheduler_access():
+    """ True if the request carries REFRESH_JOBS_SECRET. Always False when no secret is configured. """
+    if not REFRESH_JOBS_SECRET:
+        return False
+    authorization = request.headers.get('Authorization', '')
+    return hmac.compare_digest(authorization.encode(), f"Bearer {REFRESH_JOBS_SECRET}".encode())
+
 
 def register_routes(app, job_service, openai_service):
     spotify_service = SpotifyService(
@@ -76,8 +91,41 @@ def register_routes(app, job_service, openai_service):
 
     @app.route('/refresh_jobs', methods=['POST'])
     def refresh_jobs():
-        job_service.process_scheduled_jobs()
-        return jsonify({"status": "processing complete"})
+        if not has_scheduler_access():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        run = job_service.start_scheduled_run()
+        return jsonify({
+            "status": "queued",
+            "run_id": run.id,
+            "status_url": f"/refresh_jobs/{run.id}",
+        }), 202
+
+    @app.route('/refresh_jobs/<run_id>', methods=['GET'])
+    def refresh_jobs_status(run_id):
+        """Progress of a scheduled run. Pass ?stream=true to get one JSON line per second until it finishes."""
+        if not has_scheduler_access():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        progress = job_service.get_scheduled_run(run_id)
+        if not progress:
+            return jsonify({"error": f"Run {run_id} not found"}), 404
+
+        if request.args.get('stream', '').lower() not in ('1', 'true'):
+            return jsonify(progress), 200
+
+        def generate():
+            progress = job_service.get_scheduled_run(run_id)
+            while True:
+                yield json.dumps(progress) + "\n"
+                if progress['status'] in ('finished', 'failed'):
+                    break
+                time.sleep(1)
+                # End the read transaction so the next poll sees new rows
+                db.session.rollback()
+                progress = job_service.get_scheduled_run(run_id)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
     @app.route('/refresh_token', methods=['POST'])
     def refresh_token():
@@ -210,20 +258,15 @@ def register_routes(app, job_service, openai_service):
 
 
 def get_user_id_from_spotify(access_token):
-    url = 'https://api.spotify.com/v1/me'
-    headers = {
-        'Authorization': f'{access_token}'
-    }
-
-    response = requests.get(url, headers=headers)
-    print(response)
+    # The header may carry the token with or without its "Bearer " prefix
+    token = access_token.split(' ')[-1]
 
-    if response.status_code == 200:
-        user_data = response.json()
+    try:
+        user_data = create_spotify_client(token).current_user()
         return user_data.get('id')  # Spotify user_id
-    else:
+    except SpotifyException as e:
         print(
-            f"Failed to get user info: {response.status_code}, {response.text}")
+            f"Failed to get user info: {e.http_status}, {e.msg}")
         return None
         # return 'rcuomo'
 
@@ -7,7 +7,7 @@ from server.src.services.data_service import DataService
 from server.src.services.job_service import JobService
 from server.src.services.spotify_service import SpotifyService
 from spotipy import SpotifyOAuth
-import spotipy
+from spotkin_tools.scripts.spotify_client import create_spotify_client
 
 katie_id = "fshkks"
 rivers = "rcuomo"
@@ -144,8 +144,8 @@ def test_job(job_id=rivers_job_id, user_id=rivers):
     # user = User.query.filter_by(id=user_id).first()
     # token = user.token
 
-    # Initialize spotipy.Spotify directly
-    spotify = spotipy.Spotify(
+    # Initialize the Spotify client directly
+    spotify = create_spotify_client(
         auth_manager=SpotifyOAuth(
             client_id=os.getenv('SPOTIFY_CLIENT_ID'),
             client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),
@@ -7,6 +7,10 @@ from server.src.services.spotify_service import SpotifyService
 from server.src.services.job_service import JobService
 from server.src.services.data_service import DataService
 from server.src.services.openai_service import OpenAIService
+from server.src.services.artist_genre_cache import DbArtistGenreStore
+from server.src.services.playlist_cache import DbPlaylistTrackCache
+from spotkin_tools.scripts.artist_genre_cache import ArtistGenreCache, set_artist_genre_cache
+from spotkin_tools.scripts.playlist_cache import set_playlist_cache
 from server.database.database import db, init_db
 import os
 
@@ -38,6 +42,13 @@ def create_app():
 
     migrate = Migrate(app, db)
 
+    # Reuse source playlists whose snapshot_id hasn't changed since the last fetch
+    if os.getenv('PLAYLIST_CACHE_ENABLED', 'true').lower() != 'false':
+        set_playlist_cache(DbPlaylistTrackCache(app))
+
+    # Artist genres come from an in-process LRU, then the artist_genres table
+    set_artist_genre_cache(ArtistGenreCache(store=DbArtistGenreStore(app)))
+
     # Initialize services
     data_service = DataService()
     spotify_service = SpotifyService(
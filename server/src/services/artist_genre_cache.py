@@ -0,0 +1,36 @@
+from sqlalchemy.exc import SQLAlchemyError
+from server.src.models.models import ArtistGenres, db
+from rich import print
+
+
+class DbArtistGenreStore:
+    """
+    Persistent store for ArtistGenreCache backed by the artist_genres table.
+
+    Like DbPlaylistTrackCache, it pushes its own app context for every call
+    and treats database errors as cache misses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def load(self, artist_ids):
+        with self.app.app_context():
+            try:
+                rows = ArtistGenres.query.filter(ArtistGenres.artist_id.in_(list(artist_ids))).all()
+                return {row.artist_id: (row.genres, row.fetched_at) for row in rows}
+            except SQLAlchemyError as e:
+                print(f"Could not read cached artist genres: {e}")
+                return {}
+
+    def save(self, entries):
+        with self.app.app_context():
+            try:
+                for artist_id, (genres, fetched_at) in entries.items():
+                    db.session.merge(ArtistGenres(
+                        artist_id=artist_id, genres=genres, fetched_at=fetched_at))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                # Usually another job caching the same artists at the same time
+                db.session.rollback()
+                print(f"Could not cache artist genres: {e}")
@@ -0,0 +1,132 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from rich import print
+
+
+class ScheduledJobExecutor:
+    """
+    Drains a JobQueue on a bounded worker pool.
+
+    Each job runs inside its own app context, so every worker gets its own
+    database session. At most `max_workers` jobs run at once here, and at
+    most `max_workers_per_user` jobs of the same user run at once across all
+    workers (the queue checks the running rows when claiming).
+
+    While jobs run, their leases are renewed every `heartbeat_seconds`
+    (a third of the lease by default), so long jobs aren't claimed again.
+    """
+
+    def __init__(self, app, max_workers=4, max_workers_per_user=1, heartbeat_seconds=None):
+        self.app = app
+        self.max_workers = max(1, int(max_workers))
+        self.max_workers_per_user = max(1, int(max_workers_per_user))
+        self.heartbeat_seconds = heartbeat_seconds
+
+    def run(self, queue, owner, worker, run_id=None):
+        """
+        Claim rows from `queue` as `owner` (for the scheduled run `run_id`, if
+        any) and run `worker(job_id, user_id)` for each until nothing is left
+        to claim.
+
+        The worker returns a (status, message) tuple, optionally followed by
+        the job's Spotify request counts, and raises on failure. Outcomes are
+        written back to the queue, which decides whether a failed job is
+        retried. A failure never stops the other jobs. Returns the per-job
+        result dicts; pass them to summarize() for counts.
+        """
+        heartbeat_seconds = self.heartbeat_seconds or max(1, queue.lease_seconds / 3)
+        renewed_at = time.time()
+        in_flight = {}
+        results = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                # Claim jobs until the pool is full, skipping users already at their limit
+                while len(in_flight) < self.max_workers:
+                    job_run = queue.claim(owner, max_per_user=self.max_workers_per_user, run_id=run_id)
+                    if not job_run:
+                        break
+                    future = pool.submit(
+                        self.run_one, worker, job_run['job_id'], job_run['user_id'], self.app)
+                    in_flight[future] = job_run
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=max(0, renewed_at + heartbeat_seconds - time.time()),
+                               return_when=FIRST_COMPLETED)
+                if time.time() >= renewed_at + heartbeat_seconds:
+                    queue.renew([job_run for future, job_run in in_flight.items() if future not in done], owner)
+                    renewed_at = time.time()
+
+                for future in done:
+                    job_run = in_flight.pop(future)
+                    result = future.result()
+                    if result['status'] == 'failed':
+                        result['status'] = queue.fail(
+                            job_run, owner, result['message'], result['duration_seconds'],
+                            http_status=result['http_status'], retry_after=result['retry_after'],
+                            retryable=result.pop('retryable'))
+                    else:
+                        result.pop('retryable')
+                        queue.complete(job_run, owner, result['status'],
+                                       result['message'], result['duration_seconds'])
+                    results.append(result)
+
+        return results
+
+    @staticmethod
+    def run_one(worker, job_id, user_id, app):
+        """ Run a single job in a fresh app context and return its result dict. """
+        started = time.time()
+        http_status = retry_after = retryable = spotify_calls = None
+        try:
+            with app.app_context():
+                status, message, *details = worker(job_id, user_id)
+            spotify_calls = details[0] if details else None
+        except Exception as e:
+            print(f"Job {job_id} for user {user_id} failed: {e}")
+            status, message = 'failed', str(e)
+            http_status = getattr(e, 'http_status', None)
+            retry_after = getattr(e, 'retry_after', None)
+            retryable = getattr(e, 'retryable', None)
+            spotify_calls = getattr(e, 'spotify_calls', None)
+
+        return {
+            'job_id': str(job_id),
+            'user_id': user_id,
+            'status': status,
+            'message': message,
+            'http_status': http_status,
+            'retry_after': retry_after,
+            'retryable': retryable,
+            'spotify_calls': spotify_calls,
+            'duration_seconds': round(time.time() - started, 3),
+        }
+
+    @staticmethod
+    def summarize(results, duration_seconds):
+        spotify_calls = {'total': 0, 'by_endpoint': {}}
+        for result in results:
+            calls = result.get('spotify_calls') or {}
+            spotify_calls['total'] += calls.get('total', 0)
+            for endpoint, count in calls.get('by_endpoint', {}).items():
+                spotify_calls['by_endpoint'][endpoint] = spotify_calls['by_endpoint'].get(endpoint, 0) + count
+        spotify_calls['by_endpoint'] = dict(
+            sorted(spotify_calls['by_endpoint'].items(), key=lambda item: -item[1]))
+
+        summary = {
+            'total': len(results),
+            'succeeded': sum(1 for r in results if r['status'] == 'succeeded'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+            'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+            'retrying': sum(1 for r in results if r['status'] == 'retrying'),
+            'duration_seconds': round(duration_seconds, 3),
+            'spotify_calls': spotify_calls,
+            'jobs': results,
+        }
+        print(
+            f"Scheduled run finished: {summary['succeeded']} succeeded, {summary['failed']} failed, "
+            f"{summary['skipped']} skipped, {summary['retrying']} to retry in {summary['duration_seconds']}s, "
+            f"{spotify_calls['total']} Spotify requests")
+        return summary
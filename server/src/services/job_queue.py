@@ -0,0 +1,334 @@
+import os
+import random
+import socket
+import time
+from sqlalchemy.exc import IntegrityError
+from server.src.models.models import JobRun, User, db
+from rich import print
+
+# How long a claimed job stays leased to a worker without a heartbeat. The
+# worker renews the lease while the job runs; a job whose lease expires
+# (because its worker crashed) is handed out again.
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 900))
+
+# Failed jobs are retried with exponential backoff: JOB_RETRY_BASE_SECONDS,
+# then twice that, and so on, until JOB_MAX_ATTEMPTS attempts have been made
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 4))
+JOB_RETRY_BASE_SECONDS = int(os.getenv('JOB_RETRY_BASE_SECONDS', 30))
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'skipped')
+
+
+class JobFailure(Exception):
+    """
+    A scheduled job failed. `http_status` is Spotify's status code, if there
+    was one. `retryable` overrides the decision is_retryable() would make
+    from it. `spotify_calls` are the job's request counts, if known.
+    """
+
+    def __init__(self, message, http_status=None, retry_after=None, retryable=None, spotify_calls=None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.retry_after = retry_after
+        self.retryable = retryable
+        self.spotify_calls = spotify_calls
+
+
+def is_retryable(http_status):
+    """
+    Rate limits (429), server errors (5xx) and failures without a status
+    (timeouts, dropped connections) are worth retrying. Other 4xx errors,
+    such as a revoked token (401) or a deleted playlist (404), are not.
+    """
+    if http_status is None:
+        return True
+    return http_status == 429 or http_status >= 500
+
+
+def worker_name(suffix=''):
+    """ Identifies the process holding a lease, e.g. 'web.1:4242:3c0b7a1e'. """
+    name = f"{os.getenv('DYNO') or socket.gethostname()}:{os.getpid()}"
+    return f"{name}:{suffix}" if suffix else name
+
+
+class JobQueue:
+    """
+    Durable queue of scheduled job executions backed by the job_runs table.
+
+    Any number of worker processes can enqueue the same slot (rows are unique
+    per job and slot) and drain it in parallel: claim() locks a row with
+    SELECT ... FOR UPDATE SKIP LOCKED and then takes it with a conditional
+    UPDATE, so a row is never handed to two workers, even on databases
+    without row locking such as SQLite.
+
+    A claim is identified by its owner and attempt number. Workers renew()
+    the leases of the rows they are running; complete() and fail() only
+    write if the caller's claim is still the current one.
+    """
+
+    def __init__(self, lease_seconds=JOB_LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+
+    def enqueue(self, jobs, slot, run_id=None, not_before=None, priority=0):
+        """
+        Add a queued row for every job that has none for this slot yet.
+        `not_before` maps job ids to the earliest time (unix seconds) their row
+        may be claimed. Rows with a higher `priority` number are claimed after
+        all claimable rows with a lower one. Returns the number added.
+        """
+        not_before = not_before or {}
+        job_ids = [job.id for job in jobs]
+        if not job_ids:
+            return 0
+
+        for _ in range(2):
+            existing = {
+                job_id for (job_id,) in db.session.query(JobRun.job_id)
+                .filter(JobRun.slot == slot, JobRun.job_id.in_(job_ids))
+            }
+            new_runs = [
+                JobRun(job_id=job.id, user_id=job.user_id, run_id=run_id, slot=slot,
+                       next_attempt_at=not_before.get(job.id), priority=priority)
+                for job in jobs if job.id not in existing
+            ]
+            db.session.add_all(new_runs)
+            try:
+                db.session.commit()
+                return len(new_runs)
+            except IntegrityError:
+                # Another worker enqueued some of these jobs at the same time
+                db.session.rollback()
+
+        return 0
+
+    def enqueued(self, job_ids, slots):
+        """ The (job_id, slot) pairs among these jobs and slots that already have a row. """
+        if not job_ids or not slots:
+            return set()
+        return set(db.session.query(JobRun.job_id, JobRun.slot).filter(
+            JobRun.job_id.in_(job_ids),
+            JobRun.slot.in_(list(slots)),
+        ))
+
+    def fail_abandoned(self):
+        """
+        Mark rows failed whose lease expired after their last allowed attempt,
+        so a job that keeps crashing its worker isn't handed out forever.
+        Returns the number of rows failed.
+        """
+        now = int(time.time())
+        failed = JobRun.query.filter(
+            JobRun.status == 'running',
+            JobRun.lease_expires_at < now,
+            JobRun.attempts >= JOB_MAX_ATTEMPTS,
+        ).update({
+            'status': 'failed',
+            'message': 'Worker stopped responding on the last attempt',
+            'http_status': None,
+            'finished_at': now,
+            'lease_owner': None,
+            'lease_expires_at': None,
+        }, synchronize_session=False)
+        db.session.commit()
+        if failed:
+            print(f"Gave up on {failed} job(s) whose worker stopped responding on their last attempt")
+        return failed
+
+    def running_count(self, user_id, now):
+        """ Rows of a user that some worker holds a live lease on. """
+        return JobRun.query.filter(
+            JobRun.user_id == user_id,
+            JobRun.status == 'running',
+            JobRun.lease_expires_at >= now,
+        ).count()
+
+    def claim(self, owner, max_per_user=None, run_id=None):
+        """
+        Lease the claimable row with the lowest priority number (oldest first)
+        to `owner` and return it as a dict, or None if there is nothing to
+        claim. The row is tagged with `run_id`, the scheduled run claiming it.
+
+        With `max_per_user`, rows of users who already have that many rows
+        running under a live lease, claimed by any worker in any process, are
+        left for later. The user's row in `users` is locked while this is
+        checked, so concurrent claims for the same user are serialized.
+        """
+        self.fail_abandoned()
+        now = int(time.time())
+        claimable = db.or_(
+            db.and_(
+                JobRun.status == 'queued',
+                # Jobs wait for their minute in the hour, failed jobs for their backoff
+                db.or_(JobRun.next_attempt_at.is_(None), JobRun.next_attempt_at <= now),
+            ),
+            # Leased by a worker that crashed or stalled, with attempts left
+            db.and_(JobRun.status == 'running', JobRun.lease_expires_at < now,
+                    JobRun.attempts < JOB_MAX_ATTEMPTS),
+        )
+        full_users = set()
+
+        while True:
+            query = JobRun.query.filter(claimable)
+            if max_per_user:
+                running = db.aliased(JobRun)
+                busy_users = db.select(running.user_id).where(
+                    running.status == 'running',
+                    running.lease_expires_at >= now,
+                ).group_by(running.user_id).having(db.func.count() >= max_per_user)
+                query = query.filter(JobRun.user_id.notin_(busy_users))
+            if full_users:
+                query = query.filter(JobRun.user_id.notin_(list(full_users)))
+            row = query.order_by(JobRun.priority, JobRun.enqueued_at).with_for_update(
+                skip_locked=True).first()
+
+            if not row:
+                db.session.commit()
+                return None
+
+            if max_per_user:
+                # Count again under the user's lock, which a claim for the
+                # same user in another transaction waits for
+                User.query.filter(User.id == row.user_id).with_for_update().first()
+                if self.running_count(row.user_id, now) >= max_per_user:
+                    full_users.add(row.user_id)
+                    db.session.commit()
+                    continue
+
+            if row.status == 'running':
+                print(
+                    f"Reclaiming job {row.job_id} whose lease held by {row.lease_owner} expired")
+
+            # The attempts check makes this a compare-and-set, so only one
+            # worker wins the row when SKIP LOCKED isn't available
+            claimed = JobRun.query.filter(
+                JobRun.id == row.id,
+                JobRun.attempts == row.attempts,
+                claimable,
+            ).update({
+                'status': 'running',
+                'attempts': row.attempts + 1,
+                'lease_owner': owner,
+                'lease_expires_at': now + self.lease_seconds,
+                'started_at': now,
+                'claimed_run_id': run_id,
+            }, synchronize_session=False)
+            job_run = {
+                'id': row.id,
+                'job_id': row.job_id,
+                'user_id': row.user_id,
+                'slot': row.slot,
+                'attempts': row.attempts + 1,
+            }
+            db.session.commit()
+
+            if claimed:
+                return job_run
+
+    def _lease_held(self, job_run, owner):
+        """ Filter matching `job_run` only while this claim of it (owner and attempt) is current. """
+        return db.and_(
+            JobRun.id == job_run['id'],
+            JobRun.lease_owner == owner,
+            JobRun.attempts == job_run['attempts'],
+            JobRun.status == 'running',
+        )
+
+    def renew(self, job_runs, owner):
+        """
+        Push the leases of claimed rows another `lease_seconds` into the
+        future. Returns the ids of rows whose lease was lost.
+        """
+        lost = []
+        expires_at = int(time.time()) + self.lease_seconds
+        for job_run in job_runs:
+            renewed = JobRun.query.filter(self._lease_held(job_run, owner)).update(
+                {'lease_expires_at': expires_at}, synchronize_session=False)
+            if not renewed:
+                lost.append(job_run['id'])
+        db.session.commit()
+        for job_run_id in lost:
+            print(f"Lease on job run {job_run_id} was lost while it was running")
+        return lost
+
+    def complete(self, job_run, owner, status, message=None, duration_seconds=None, http_status=None):
+        """ Record the outcome of a claimed row. Returns False if `owner` no longer holds this claim. """
+        updated = JobRun.query.filter(self._lease_held(job_run, owner)).update({
+            'status': status,
+            'message': message,
+            'http_status': http_status,
+            'duration_seconds': duration_seconds,
+            'next_attempt_at': None,
+            'finished_at': int(time.time()),
+            'lease_owner': None,
+            'lease_expires_at': None,
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if not updated:
+            print(
+                f"Lease on job run {job_run['id']} was lost before it finished; outcome {status} not recorded")
+        return bool(updated)
+
+    def fail(self, job_run, owner, message, duration_seconds=None, http_status=None, retry_after=None,
+             retryable=None):
+        """
+        Record a failed attempt of a claimed row. Retryable failures go back on
+        the queue with exponential backoff (or Spotify's Retry-After, if longer)
+        until JOB_MAX_ATTEMPTS is reached. Returns 'retrying' or 'failed'.
+        """
+        attempts = job_run['attempts']
+        if retryable is None:
+            retryable = is_retryable(http_status)
+        if not retryable or attempts >= JOB_MAX_ATTEMPTS:
+            print(
+                f"Giving up on job {job_run['job_id']} after {attempts} attempt(s) (status {http_status}): {message}")
+            self.complete(job_run, owner, 'failed', message, duration_seconds,
+                          http_status=http_status)
+            return 'failed'
+
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        try:
+            delay = max(delay, int(retry_after))
+        except (TypeError, ValueError):
+            pass
+        # Jitter keeps jobs that failed together from retrying together
+        delay += random.uniform(0, delay / 10)
+
+        print(
+            f"Retrying job {job_run['job_id']} in {delay:.0f}s after attempt {attempts} failed (status {http_status}): {message}")
+        updated = JobRun.query.filter(self._lease_held(job_run, owner)).update({
+            'status': 'queued',
+            'message': message,
+            'http_status': http_status,
+            'duration_seconds': duration_seconds,
+            'next_attempt_at': int(time.time() + delay),
+            'lease_owner': None,
+            'lease_expires_at': None,
+        }, synchronize_session=False)
+        db.session.commit()
+        if not updated:
+            print(f"Lease on job run {job_run['id']} was lost before it finished; retry not recorded")
+        return 'retrying' if updated else 'failed'
+
+    def next_due_at(self):
+        """
+        When the earliest queued row that is still waiting becomes claimable,
+        or None if there is none. Rows that are already due don't count: if
+        they weren't claimed, their user is at the per-user limit, and a
+        later drain picks them up.
+        """
+        next_attempt_at = db.session.query(db.func.min(JobRun.next_attempt_at)).filter(
+            JobRun.status == 'queued',
+            JobRun.next_attempt_at > int(time.time()),
+        ).scalar()
+        db.session.commit()
+        return next_attempt_at
+
+    def get_run(self, run_id):
+        """
+        Rows a scheduled run enqueued or claimed, oldest first. Later ticks of
+        an hour enqueue nothing new but claim the rows the first one enqueued.
+        """
+        return JobRun.query.filter(
+            db.or_(JobRun.run_id == run_id, JobRun.claimed_run_id == run_id),
+        ).order_by(JobRun.enqueued_at).all()
@@ -2,19 +2,64 @@ import datetime
 import os
 from server.src.models.models import Ingredient, Job, Token, User
 from server.src.services import spotify_service
+from server.src.services.job_executor import ScheduledJobExecutor
+from server.src.services.job_queue import JobFailure, JobQueue, worker_name
+from server.src.services.scheduled_run import ScheduledRun, ScheduledRunRegistry
 from spotkin_tools.scripts.process_job import process_job as tools_process_job
+from spotkin_tools.scripts.api import get_tracks
+from spotkin_tools.scripts.shared_playlists import SharedPlaylistTracks
+from spotkin_tools.scripts.spotify_client import SPOTIFY_JOB_CALL_BUDGET, SpotifyCallBudgetExceeded, request_coalescer
+import threading
 import time
+import requests
 import spotipy
-from flask import Response, jsonify
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Response, current_app, jsonify
 from server.src.models.models import db
 from rich import print
 import uuid
+import zlib
+
+# Jobs whose configuration hasn't been updated in 21 days are frozen and not run
+FREEZE_THRESHOLD_SECONDS = 1814400
+
+# Worker pool limits for process_scheduled_jobs. Set SCHEDULED_JOBS_MAX_WORKERS=1
+# to run every job sequentially in the request thread.
+SCHEDULED_JOBS_MAX_WORKERS = int(os.getenv('SCHEDULED_JOBS_MAX_WORKERS', 4))
+SCHEDULED_JOBS_MAX_WORKERS_PER_USER = int(
+    os.getenv('SCHEDULED_JOBS_MAX_WORKERS_PER_USER', 1))
+# How long a scheduled run keeps waiting for retries and upcoming jobs
+JOB_RETRY_MAX_WAIT = int(os.getenv('JOB_RETRY_MAX_WAIT', 300))
+# Jobs of the same hour are spread over its first SCHEDULE_SPREAD_MINUTES
+# minutes instead of all starting at minute 0. Set to 1 to disable.
+SCHEDULE_SPREAD_MINUTES = min(60, max(1, int(os.getenv('SCHEDULE_SPREAD_MINUTES', 50))))
+# Jobs whose slot in the last CATCH_UP_HOURS hours passed without a successful
+# run (a missed tick, a timed-out run) are caught up, at most CATCH_UP_MAX_JOBS
+# per tick and behind the current hour's jobs. Set CATCH_UP_HOURS=0 to disable.
+CATCH_UP_HOURS = int(os.getenv('CATCH_UP_HOURS', 3))
+CATCH_UP_MAX_JOBS = int(os.getenv('CATCH_UP_MAX_JOBS', 50))
+CATCH_UP_PRIORITY = 1
+# Load each source playlist once per scheduled run and share it between jobs
+SHARE_SOURCE_PLAYLISTS = os.getenv('SHARE_SOURCE_PLAYLISTS', 'true').lower() != 'false'
+# Related artists whose top tracks aren't back this many seconds into an
+# artist recommendation are left out
+RELATED_ARTISTS_DEADLINE_SECONDS = float(os.getenv('RELATED_ARTISTS_DEADLINE_SECONDS', 5))
+
+
+def minute_offset(job_id):
+    """
+    The minute within its scheduled hour at which a job runs. Derived from
+    the job id, so it never changes between runs or processes.
+    """
+    return zlib.crc32(str(job_id).encode()) % SCHEDULE_SPREAD_MINUTES
 
 
 class JobService:
     def __init__(self, data_service, spotify_service):
         self.data_service = data_service
         self.spotify_service = spotify_service
+        self.runs = ScheduledRunRegistry()
+        self.job_queue = JobQueue()
 
     def add_job(self, user_id, job_data):
         new_job = Job(
@@ -80,7 +125,7 @@ class JobService:
         }
         return jsonify({"status": "success", "schedule": schedule_info})
 
-    def process(self, spotify, job_id, user_id):
+    def process(self, spotify, job_id, user_id, shared_playlists=None):
         try:
             job = Job.query.filter_by(id=job_id, user_id=user_id).first()
 
@@ -88,12 +133,26 @@ class JobService:
                 return {'status': 'error', 'message': 'Job not found.'}, 404
 
             job_dict = self.convert_server_job_to_tools_job(job)
-            if tools_process_job(spotify, job_dict):
+            if tools_process_job(spotify, job_dict, shared_playlists=shared_playlists):
                 return {'status': 'success', 'message': 'Job processed successfully.'}, 200
             else:
                 return {'status': 'error', 'message': 'Job processing failed.'}, 500
+        except spotipy.exceptions.SpotifyException as e:
+            # Pass Spotify's status through so callers can tell rate limits from bad tokens
+            return {
+                'status': 'error',
+                'message': str(e),
+                'retry_after': (e.headers or {}).get('Retry-After'),
+            }, e.http_status or 500
+        except SpotifyCallBudgetExceeded as e:
+            # The recipe needs more requests than a job may make; retrying won't change that
+            return {'status': 'error', 'message': str(e), 'http_status': None, 'retryable': False}, 500
+        except requests.exceptions.RequestException as e:
+            # Timeouts and dropped connections have no status and are worth retrying
+            return {'status': 'error', 'message': str(e), 'http_status': None}, 500
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}, 500
+            # A bug or bad job data rather than a Spotify error; retrying won't fix it
+            return {'status': 'error', 'message': str(e), 'http_status': None, 'retryable': False}, 500
 
     def process_job(self, job_id, request):
         """ When the user clicks 'Update' in the UI, this function is called to process the job immediately. """
@@ -105,7 +164,8 @@ class JobService:
 
         try:
             # Create Spotify client with access token
-            spotify = spotipy.Spotify(auth=access_token)
+            spotify = self.spotify_service.create_spotify_client(
+                {'access_token': access_token}, call_budget=SPOTIFY_JOB_CALL_BUDGET)
 
             # Get the current user
             user = spotify.current_user()
@@ -135,8 +195,10 @@ class JobService:
 
             # Commit the token information
             db.session.commit()
+            self.spotify_service.store_token(user_id, token.token_info)
 
             data, code = self.process(spotify, job_id, user_id)
+            print(f"Job {job_id}: {spotify.call_counter.summary()}")
 
             if code != 200:
                 return jsonify({'status': 'error', 'message': data['message']}), code
@@ -150,165 +212,253 @@ class JobService:
         except spotipy.exceptions.SpotifyException as e:
             return jsonify({'status': 'error', 'message': str(e)}), 401
 
-    def process_scheduled_jobs(self):
+    def start_scheduled_run(self):
+        """
+        Start process_scheduled_jobs in a background thread and return its
+        ScheduledRun right away. Poll get_scheduled_run(run.id) for progress.
+        """
+        run = self.runs.create()
+        app = current_app._get_current_object()
+
+        def target():
+            with app.app_context():
+                try:
+                    self.process_scheduled_jobs(run=run)
+                except Exception as e:
+                    print(f"Scheduled run {run.id} failed: {e}")
+                    run.finish(error=str(e))
+
+        threading.Thread(target=target, name=f"scheduled-run-{run.id}", daemon=True).start()
+        return run
+
+    def get_scheduled_run(self, run_id):
+        """ Progress of a scheduled run as a dict, or None if the run is unknown. """
+        job_runs = self.job_queue.get_run(run_id)
+        run = self.runs.get(run_id) or ScheduledRun.from_job_runs(run_id, job_runs)
+        return run.to_dict(job_runs) if run else None
+
+    def process_scheduled_jobs(self, max_workers=None, max_workers_per_user=None, run=None):
+        """
+        Enqueue every job scheduled for the current hour, plus a capped number
+        of jobs that missed their slot in the last CATCH_UP_HOURS hours, and
+        drain the queue.
+
+        Each job runs at its own minute within the hour (see minute_offset), so
+        this should be called every few minutes; every call runs the jobs whose
+        minute has passed. Several processes can call this for the same hour:
+        each job is enqueued once and claimed by exactly one of them. Returns a
+        summary of the jobs this process ran.
+        """
         print('process_scheduled_jobs...')
+        run = run or self.runs.create()
+        run.start()
 
         now = datetime.datetime.now(datetime.timezone.utc)
-        now_timestamp = now.timestamp()
-        current_hour = now.hour
+        slot = int(now.replace(minute=0, second=0, microsecond=0).timestamp())
 
-        jobs = Job.query.all()  # Fetch all jobs
+        due_jobs = self._get_due_jobs(now)
+        added = self.job_queue.enqueue(due_jobs, slot, run_id=run.id, not_before={
+            job.id: slot + minute_offset(job.id) * 60 for job in due_jobs})
+        print(f"{len(due_jobs)} jobs due for hour {now.hour}, {added} newly enqueued")
 
-        for job in jobs:
-            scheduled_time = job.scheduled_time
-            user_id = job.user_id
+        caught_up = self._enqueue_missed_jobs(now, slot, run)
+        if caught_up:
+            print(f"{caught_up} jobs from missed hours enqueued to catch up")
 
-            if scheduled_time == current_hour:
+        summary = self.drain_job_queue(max_workers, max_workers_per_user, run=run, now=now)
+        run.finish(summary)
+        return summary
 
-                # Convert job.last_updated to seconds if it's in milliseconds
-                if job.last_updated:
-                    if job.last_updated > 1e12:  # Threshold to distinguish between ms and s
-                        job_last_updated_seconds = job.last_updated / 1000
-                    else:
-                        job_last_updated_seconds = job.last_updated
-
-                    # Check if job.last_updated is in the future
-                    if job_last_updated_seconds > now_timestamp:
-                        print(
-                            f"Job {user_id} has a last_updated timestamp in the future.")
-                        continue
-
-                    # Calculate the time difference
-                    time_difference = now_timestamp - job_last_updated_seconds
-
-                    # Skip jobs not updated in last 21 days
-                    if time_difference > 1814400:
-                        print(
-                            f"Skipping job for user: {user_id} because it hasn't been updated in the last 21 days")
-                        continue
-                else:
-                    print(f"Job {user_id} has no last_updated timestamp.")
-                    continue  # Decide whether to skip or process jobs without a last_updated timestamp
+    def drain_job_queue(self, max_workers=None, max_workers_per_user=None, run=None, now=None):
+        """
+        Run queued jobs (and jobs whose lease expired) until none are left to
+        claim. Jobs that become due within JOB_RETRY_MAX_WAIT seconds (retries,
+        or jobs whose minute in the hour is coming up) are waited for.
 
-                print(
-                    f"Processing job for user: {user_id} because scheduled time {scheduled_time} matches current hour {current_hour}")
+        Source playlists are loaded once per call and shared by all the jobs
+        it runs (unless SHARE_SOURCE_PLAYLISTS is false).
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        owner = worker_name(run.id[:8] if run else '')
+        shared_playlists = SharedPlaylistTracks() if SHARE_SOURCE_PLAYLISTS else None
 
-                # Retrieve the token for the user
-                token = Token.query.filter_by(user_id=user_id).first()
-                if not token or not token.token_info.get('access_token'):
-                    print(f"No valid token found for user: {user_id}")
-                    continue
+        def worker(job_id, user_id):
+            return self._run_scheduled_job(job_id, user_id, now, shared_playlists)
 
-                # Refresh the token if needed
-                token_info_with_new_refresh_token = self.spotify_service.refresh_token_if_expired(
-                    token.token_info)
+        executor = ScheduledJobExecutor(
+            current_app._get_current_object(),
+            max_workers=max_workers or SCHEDULED_JOBS_MAX_WORKERS,
+            max_workers_per_user=max_workers_per_user or SCHEDULED_JOBS_MAX_WORKERS_PER_USER,
+        )
 
-                # Update the token info in the database
-                token.token_info = token_info_with_new_refresh_token
-                db.session.commit()
+        started = time.time()
+        coalescing_before = request_coalescer.stats()
+        results = []
+        while True:
+            results.extend(executor.run(self.job_queue, owner, worker, run_id=run.id if run else None))
+
+            next_due_at = self.job_queue.next_due_at()
+            if not next_due_at or next_due_at - started > JOB_RETRY_MAX_WAIT:
+                break
+            print(f"Waiting {max(0, next_due_at - time.time()):.0f}s for the next queued job")
+            time.sleep(max(0, next_due_at - time.time()))
+
+        summary = ScheduledJobExecutor.summarize(results, time.time() - started)
+        if shared_playlists:
+            shared_playlists.log_stats()
+            summary['shared_playlists'] = shared_playlists.stats()
+
+        # The coalescer is process-wide, so report what changed during this drain
+        coalescing = {key: request_coalescer.stats()[key] - coalescing_before[key]
+                      for key in ('requests', 'coalesced')}
+        print(f"Coalesced {coalescing['coalesced']} identical concurrent Spotify requests "
+              f"into {coalescing['requests']}")
+        summary['request_coalescing'] = coalescing
+        return summary
+
+    def _get_due_jobs(self, now):
+        """
+        Return the jobs scheduled for the current hour that are not frozen.
+
+        The hour match and the 21-day freeze rule run in the database and are
+        served by the (scheduled_time, last_updated) index. Jobs without a
+        last_updated timestamp or with one in the future are never due.
+        """
+        return Job.query.filter(
+            Job.scheduled_time == now.hour,
+            self._not_frozen(now),
+        ).all()
 
-                # Create Spotify client using the refreshed token
-                spotify = self.spotify_service.create_spotify_client(
-                    token.token_info
+    def _get_missed_jobs(self, now, slot):
+        """
+        Return (job, missed_slot) pairs for unfrozen jobs whose slot in the last
+        CATCH_UP_HOURS hours passed without a successful run, i.e. whose
+        last_autorun is older than that slot. A job is scheduled once a day, so
+        it has at most one such slot.
+        """
+        missed_slots = {
+            (now.hour - hours_ago) % 24: slot - hours_ago * 3600
+            for hours_ago in range(1, min(CATCH_UP_HOURS, 23) + 1)
+        }
+        if not missed_slots:
+            return []
+
+        jobs = Job.query.filter(
+            db.or_(*[
+                db.and_(
+                    Job.scheduled_time == hour,
+                    db.or_(Job.last_autorun.is_(None), Job.last_autorun < missed_slot),
                 )
+                for hour, missed_slot in missed_slots.items()
+            ]),
+            self._not_frozen(now),
+        ).all()
+        return [(job, missed_slots[job.scheduled_time]) for job in jobs]
 
-                # Call the process method
-                data, status_code = self.process(spotify, job.id, user_id)
+    def _enqueue_missed_jobs(self, now, slot, run):
+        """
+        Enqueue up to CATCH_UP_MAX_JOBS missed jobs, oldest slot first, behind
+        the current hour's jobs. Jobs already enqueued for their missed slot
+        (still queued, retrying or given up on) are left alone. Returns the
+        number enqueued.
+        """
+        missed = self._get_missed_jobs(now, slot)
+        if not missed:
+            return 0
+
+        enqueued = self.job_queue.enqueued(
+            [job.id for job, _ in missed], {missed_slot for _, missed_slot in missed})
+        missed = [(job, missed_slot) for job, missed_slot in missed
+                  if (job.id, missed_slot) not in enqueued]
+        missed.sort(key=lambda pair: pair[1])
+        if len(missed) > CATCH_UP_MAX_JOBS:
+            print(
+                f"{len(missed)} jobs missed their slot; catching up {CATCH_UP_MAX_JOBS} now and the rest on later ticks")
+            missed = missed[:CATCH_UP_MAX_JOBS]
+
+        jobs_by_slot = {}
+        for job, missed_slot in missed:
+            jobs_by_slot.setdefault(missed_slot, []).append(job)
+
+        return sum(
+            self.job_queue.enqueue(jobs, missed_slot, run_id=run.id, priority=CATCH_UP_PRIORITY)
+            for missed_slot, jobs in jobs_by_slot.items()
+        )
 
-                if status_code != 200:
-                    message = str(data['message'])
-                    raise Exception(
-                        f"Job processing failed with message: {message}")
-                else:
-                    print(f"Job processed successfully: {data['message']}")
+    @staticmethod
+    def _not_frozen(now):
+        """ SQL condition for jobs updated in the last 21 days (last_updated in seconds or milliseconds). """
+        now_timestamp = int(now.timestamp())
+        cutoff = now_timestamp - FREEZE_THRESHOLD_SECONDS
+
+        return db.or_(
+            # last_updated stored in seconds
+            Job.last_updated.between(cutoff, now_timestamp),
+            # last_updated stored in milliseconds
+            Job.last_updated.between(cutoff * 1000, now_timestamp * 1000),
+        )
 
-                # Update last_autorun timestamp
-                job.last_autorun = now.timestamp()
-                db.session.commit()
+    def _run_scheduled_job(self, job_id, user_id, now, shared_playlists=None):
+        """
+        Process a single scheduled job. Returns a (status, message) tuple, plus
+        the job's Spotify request counts once it has made requests, and raises
+        JobFailure if the job fails.
+        """
+        job = Job.query.filter_by(id=job_id).first()
+        if not job:
+            return 'skipped', 'Job no longer exists.'
 
-                print(f"Job processed successfully for user: {user_id}")
+        print(
+            f"Processing job for user: {user_id} scheduled for hour {job.scheduled_time}")
 
-            else:
-                f"Skipping job for user: {job.user_id} because scheduled time {scheduled_time} does not match current hour {current_hour}"
-
-        def get_schedule(self):
-            all_jobs = self.data_service.get_all_data()
-            schedule_info = {
-                user_id: {
-                    'jobs': [{
-                        'name': job.get('name', 'Unnamed job'),
-                        'scheduled_time': job['scheduled_time'],
-                        'last_processed': job.get('last_processed', 'Never'),
-                    } for job in user_data.get('jobs', [])]
-                } for user_id, user_data in all_jobs.items()
-            }
-            return jsonify({"status": "success", "schedule": schedule_info})
+        # Retrieve the token for the user
+        token = Token.query.filter_by(user_id=user_id).first()
+        if not token or not token.token_info.get('access_token'):
+            print(f"No valid token found for user: {user_id}")
+            return 'skipped', 'No valid token found.'
 
-        def update_job(self, job_id, updated_job_data, user_id):
-            print(f"Updating job {job_id} for user {user_id}")
-            # ensure the user is in the db
-            self.ensure_user_exists(user_id)
-            # Try to find the existing job by job_id and user_id
-            job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+        # Refresh the token if it expires soon
+        try:
+            token_info, changed = self.spotify_service.get_valid_token(
+                user_id, token.token_info)
+        except spotipy.oauth2.SpotifyOauthError as e:
+            # The refresh token was revoked or is invalid; retrying won't help
+            raise JobFailure(f"Failed to refresh Spotify access token: {e}", http_status=401)
+
+        # Update the token info in the database if it was refreshed
+        if changed:
+            token.token_info = token_info
+            db.session.commit()
 
-            if job:
-                # Update the existing job with new data
-                for key, value in updated_job_data.items():
-                    if hasattr(job, key):
-                        if key == 'recipe':
-                            # Handle the 'recipe' separately since it's a relationship
-                            job.recipe = []  # Clear existing ingredients
-
-                            # Use a set to track playlist IDs for preventing duplicate ingredients
-                            added_playlists = set()
-
-                            for ingredient_data in value:
-                                ingredient = Ingredient.from_dict(
-                                    ingredient_data)
-                                # Use the playlist id to determine uniqueness
-                                playlist_id = ingredient.playlist.get('id')
-
-                                if playlist_id not in added_playlists:
-                                    job.recipe.append(ingredient)
-                                    added_playlists.add(playlist_id)
-                                    # Update the last_updated timestamp
-                                    job.last_updated = int(time.time())
-                                else:
-                                    print(
-                                        f"Duplicate playlist detected: {playlist_id}, skipping.")
-                        else:
-                            # Update scalar attributes
-                            setattr(job, key, value)
-                    else:
-                        print(
-                            f"Server Job model does not have attribute: {key}")
-            else:
-                # Create a new job if it doesn't exist
-                job = Job.from_dict(updated_job_data)
-                job.id = job_id  # Assign the provided job_id
-                job.user_id = user_id  # Ensure the job is linked to the correct user
-                # Update the last_updated timestamp
-                job.last_updated = int(time.time())
-                db.session.add(job)
-
-            db.session.commit()  # Commit the changes to the database
-            return job.to_dict()  # Return the job as a dictionary
-
-        def update_job_schedule(self, data):
-            user_id = data['user_id']
-            new_time = data['new_time']
-            job_name = data.get('job_name', None)
-
-            all_jobs = self.data_service.get_all_data()
-            if user_id in all_jobs:
-                for job in all_jobs[user_id]['jobs']:
-                    if job_name is None or job['name'] == job_name:
-                        job['scheduled_time'] = new_time
-                self.data_service.store_job_and_token(
-                    user_id, all_jobs[user_id]['jobs'], all_jobs[user_id]['token'])
-                return jsonify({"status": "updated", "new_time": new_time})
-            else:
-                return jsonify({"status": "error", "message": "User not found"}), 404
+        # Create Spotify client using the refreshed token
+        spotify = self.spotify_service.create_spotify_client(
+            token_info, call_budget=SPOTIFY_JOB_CALL_BUDGET
+        )
+
+        # Call the process method
+        data, status_code = self.process(spotify, job.id, user_id, shared_playlists)
+        spotify_calls = spotify.call_counter.to_dict()
+        print(f"Job {job_id}: {spotify.call_counter.summary()}")
+
+        if status_code != 200:
+            message = str(data['message'])
+            raise JobFailure(
+                f"Job processing failed with message: {message}",
+                # Errors that didn't come from Spotify carry no status
+                http_status=data.get('http_status', status_code),
+                retry_after=data.get('retry_after'),
+                retryable=data.get('retryable'),
+                spotify_calls=spotify_calls,
+            )
+        else:
+            print(f"Job processed successfully: {data['message']}")
+
+        # Update last_autorun timestamp
+        job.last_autorun = now.timestamp()
+        db.session.commit()
+
+        print(f"Job processed successfully for user: {user_id}")
+        return 'succeeded', data['message'], spotify_calls
 
     def get_job_by_id(self, job_id):
         """
@@ -346,14 +496,14 @@ class JobService:
             
         # Try to refresh the token if needed
         try:
-            token_info_with_refresh = self.spotify_service.refresh_token_if_expired(token.token_info)
+            token_info, changed = self.spotify_service.get_valid_token(user_id, token.token_info)
             # Update token in database if refreshed
-            if token_info_with_refresh != token.token_info:
-                token.token_info = token_info_with_refresh
+            if changed:
+                token.token_info = token_info
                 db.session.commit()
                 
             # Create Spotify client with refreshed token
-            spotify = spotipy.Spotify(auth=token.token_info.get('access_token'))
+            spotify = self.spotify_service.create_spotify_client(token_info)
         except Exception as e:
             print(f"Error refreshing token: {e}")
             raise ValueError(f"Failed to refresh Spotify access token: {str(e)}")
@@ -376,7 +526,7 @@ class JobService:
                 try:
                     # Try to get top tracks from the artist's country
                     artist_top_tracks = spotify.artist_top_tracks(artist_id, country='US')
-                    tracks = artist_top_tracks['tracks']
+                    tracks = list(artist_top_tracks['tracks'])
                     print(f"Found {len(tracks)} top tracks from artist")
                 except Exception as e:
                     print(f"Error getting artist top tracks: {e}")
@@ -446,36 +596,8 @@ class JobService:
                 print(f"No official 'This Is {artist_name}' playlist found. Creating custom playlist.")
                 name_prefix = f"Based on artist: {item_name}"
                 
-                # Get the artist's top tracks
-                try:
-                    # Get the artist's top tracks - specify US as the country
-                    artist_top_tracks = spotify.artist_top_tracks(item_id, country='US')
-                    tracks = artist_top_tracks['tracks']
-                    print(f"Found {len(tracks)} top tracks for {artist_name}")
-                except Exception as e:
-                    print(f"Error getting top tracks: {e}")
-                    raise ValueError(f"Could not get top tracks for artist: {str(e)}")
-                
-                # Try to get related artists if we need more tracks
-                if len(tracks) < 15:
-                    try:
-                        print(f"Getting related artists for {artist_name}")
-                        related_artists = spotify.artist_related_artists(item_id)
-                        related_count = 0
-                        
-                        for related in related_artists['artists'][:3]:  # Add tracks from up to 3 related artists
-                            try:
-                                related_top = spotify.artist_top_tracks(related['id'], country='US')
-                                if related_top and 'tracks' in related_top:
-                                    print(f"Adding tracks from related artist: {related['name']}")
-                                    tracks.extend(related_top['tracks'][:5])  # Add up to 5 tracks per related artist
-                                    related_count += 1
-                            except Exception as e:
-                                print(f"Could not get top tracks for related artist {related['name']}: {e}")
-                        print(f"Added tracks from {related_count} related artists")
-                    except Exception as e:
-                        print(f"Error getting related artists: {e}")
-                        # Continue without related artists
+                # Get the artist's top tracks, plus related artists' if there are too few
+                tracks = self._get_artist_and_related_top_tracks(spotify, item_id, artist_name)
                 
             elif source_type == 'album':
                 # Verify album exists
@@ -486,31 +608,17 @@ class JobService:
                 
                 # Get all tracks from the album
                 try:
-                    tracks = []
-                    album_tracks = spotify.album_tracks(item_id)
-                    
-                    # Process initial results
-                    track_items = album_tracks['items']
-                    for track in track_items:
-                        if track.get('id'):
-                            # Get full track data
-                            try:
-                                full_track = spotify.track(track['id'])
-                                tracks.append(full_track)
-                            except Exception as e:
-                                print(f"Error getting full track data for {track['id']}: {e}")
+                    # The album object already holds the first page of its tracks
+                    album_tracks = album['tracks']
+                    track_ids = [track['id'] for track in album_tracks['items'] if track.get('id')]
                     
                     # Handle pagination if there are more tracks
                     while album_tracks['next']:
                         album_tracks = spotify.next(album_tracks)
-                        for track in album_tracks['items']:
-                            if track.get('id'):
-                                try:
-                                    full_track = spotify.track(track['id'])
-                                    tracks.append(full_track)
-                                except Exception as e:
-                                    print(f"Error getting full track data for {track['id']}: {e}")
+                        track_ids.extend(track['id'] for track in album_tracks['items'] if track.get('id'))
                     
+                    # Album tracks are simplified objects; get full track data 50 at a time
+                    tracks = get_tracks(spotify, track_ids)
                     print(f"Found {len(tracks)} tracks from album")
                     
 
@@ -600,6 +708,70 @@ class JobService:
         # Return updated job
         return job.to_dict()
     
+    def _get_artist_and_related_top_tracks(self, spotify, artist_id, artist_name):
+        """
+        The artist's top tracks, topped up with up to 5 top tracks from each of
+        up to 3 related artists when there are fewer than 15.
+
+        The related artists are looked up while the artist's own top tracks are
+        fetched, and their top tracks are fetched in parallel. Related artists
+        whose tracks aren't back RELATED_ARTISTS_DEADLINE_SECONDS after the
+        start are dropped, so the request waits for the slowest call, not the
+        sum of all of them.
+        """
+        deadline = time.time() + RELATED_ARTISTS_DEADLINE_SECONDS
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            # Get the artist's top tracks - specify US as the country
+            top_tracks_future = pool.submit(spotify.artist_top_tracks, artist_id, country='US')
+            related_future = pool.submit(spotify.artist_related_artists, artist_id)
+
+            try:
+                # Copy: responses may be shared with concurrent requests
+                tracks = list(top_tracks_future.result()['tracks'])
+                print(f"Found {len(tracks)} top tracks for {artist_name}")
+            except Exception as e:
+                print(f"Error getting top tracks: {e}")
+                raise ValueError(f"Could not get top tracks for artist: {str(e)}")
+
+            if len(tracks) >= 15:
+                return tracks
+
+            try:
+                print(f"Getting related artists for {artist_name}")
+                related_artists = related_future.result(
+                    timeout=max(0, deadline - time.time()))['artists'][:3]
+            except Exception as e:
+                # Continue without related artists
+                print(f"Error getting related artists: {e!r}")
+                return tracks
+
+            related_futures = {
+                pool.submit(spotify.artist_top_tracks, related['id'], country='US'): related
+                for related in related_artists
+            }
+            done, not_done = wait(related_futures, timeout=max(0, deadline - time.time()))
+
+            related_count = 0
+            # Keep the related artists' order, whichever call finished first
+            for future, related in related_futures.items():
+                if future in not_done:
+                    print(f"Dropped related artist {related['name']}: no top tracks before the deadline")
+                    continue
+                try:
+                    related_top = future.result()
+                    if related_top and 'tracks' in related_top:
+                        print(f"Adding tracks from related artist: {related['name']}")
+                        tracks.extend(related_top['tracks'][:5])  # Add up to 5 tracks per related artist
+                        related_count += 1
+                except Exception as e:
+                    print(f"Could not get top tracks for related artist {related['name']}: {e}")
+            print(f"Added tracks from {related_count} related artists")
+            return tracks
+        finally:
+            # Don't make the request wait for calls that missed the deadline
+            pool.shutdown(wait=False, cancel_futures=True)
+
     def update_job(self, job_id, updated_job_data, user_id):
         print(f"Updating job {job_id} for user {user_id}")
         # ensure the user is in the db
@@ -0,0 +1,39 @@
+from sqlalchemy.exc import SQLAlchemyError
+from server.src.models.models import PlaylistCache, db
+from spotkin_tools.scripts.playlist_cache import PlaylistTrackCache
+from rich import print
+
+
+class DbPlaylistTrackCache(PlaylistTrackCache):
+    """
+    Playlist track cache backed by the playlist_cache table, shared by every
+    worker process.
+
+    Source playlists are fetched from get_all_tracks' own threads, which have
+    no app context, so every call pushes one (and with it, its own session).
+    A failing cache is logged and treated as a miss, never as a failed job.
+    """
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def get(self, playlist_id):
+        with self.app.app_context():
+            try:
+                entry = db.session.get(PlaylistCache, playlist_id)
+                return (entry.snapshot_id, entry.items) if entry else None
+            except SQLAlchemyError as e:
+                print(f"Could not read cached playlist {playlist_id}: {e}")
+                return None
+
+    def set(self, playlist_id, snapshot_id, items):
+        with self.app.app_context():
+            try:
+                db.session.merge(PlaylistCache(
+                    playlist_id=playlist_id, snapshot_id=snapshot_id, items=items))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                # Usually another job storing the same playlist at the same time
+                db.session.rollback()
+                print(f"Could not cache playlist {playlist_id}: {e}")
@@ -0,0 +1,113 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+JOB_STATUSES = ('scheduled', 'queued', 'running', 'succeeded', 'failed', 'skipped')
+
+
+class ScheduledRun:
+    """
+    Lifecycle of one scheduled run started by this process. The state of the
+    individual jobs lives in the job_runs table (see JobQueue).
+    """
+
+    def __init__(self, run_id=None):
+        self.id = run_id or str(uuid.uuid4())
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.summary = None
+
+    def start(self):
+        self.status = 'running'
+        self.started_at = time.time()
+
+    def finish(self, summary=None, error=None):
+        self.status = 'failed' if error else 'finished'
+        self.summary = summary
+        self.error = error
+        self.finished_at = time.time()
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def to_dict(self, job_runs):
+        """
+        Progress of the run given the job_runs rows it enqueued or claimed.
+        Rows waiting for their minute within the hour are reported as
+        'scheduled'.
+        """
+        now = time.time()
+        jobs = [job_run.to_dict() for job_run in job_runs]
+        for job in jobs:
+            if job['status'] == 'queued' and job['attempts'] == 0 and (job['next_attempt_at'] or 0) > now:
+                job['status'] = 'scheduled'
+
+        counts = {status: 0 for status in JOB_STATUSES}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+
+        status = self.status
+        if status == 'finished' and (counts['queued'] or counts['running']):
+            # This process is done but other workers are still draining the run.
+            # Jobs still waiting for their minute don't keep the run open.
+            status = 'running'
+
+        return {
+            'run_id': self.id,
+            'status': status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'total': len(jobs),
+            **counts,
+            # Spotify requests and source playlist sharing stats of this
+            # process's part of the run
+            'spotify_calls': (self.summary or {}).get('spotify_calls'),
+            'shared_playlists': (self.summary or {}).get('shared_playlists'),
+            'request_coalescing': (self.summary or {}).get('request_coalescing'),
+            'jobs': jobs,
+        }
+
+    @classmethod
+    def from_job_runs(cls, run_id, job_runs):
+        """
+        Rebuild a run started by another process (or before a restart) from
+        the rows it enqueued or claimed. Returns None if there are none.
+        """
+        if not job_runs:
+            return None
+
+        run = cls(run_id)
+        run.created_at = min(job_run.enqueued_at or 0 for job_run in job_runs)
+        run.started_at = run.created_at
+        # to_dict() reports the run as running while any of its jobs are
+        run.status = 'finished'
+        run.finished_at = max(job_run.finished_at or 0 for job_run in job_runs) or None
+        return run
+
+
+class ScheduledRunRegistry:
+    """ Keeps the most recent scheduled runs of this process, by run id. """
+
+    def __init__(self, max_runs=50):
+        self.max_runs = max_runs
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self):
+        run = ScheduledRun()
+        with self._lock:
+            self._runs[run.id] = run
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        return run
+
+    def get(self, run_id):
+        with self._lock:
+            return self._runs.get(run_id)
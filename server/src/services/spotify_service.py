@@ -1,6 +1,25 @@
-import spotipy
+import os
+import threading
+import time
+from spotipy.cache_handler import CacheHandler
 from spotipy.oauth2 import SpotifyOAuth
 from urllib.parse import urlencode
+from spotkin_tools.scripts.spotify_client import SPOTIFY_TIMEOUT, create_spotify_client
+
+# Access tokens are refreshed this many seconds before they expire, so a job
+# never starts with a token that runs out halfway through
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('TOKEN_REFRESH_MARGIN_SECONDS', 300))
+
+
+class NoCacheHandler(CacheHandler):
+    """ The server serves many users, so SpotifyOAuth must never reuse a cached token. """
+
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
 
 class SpotifyService:
     def __init__(self, client_id, client_secret, redirect_uri):
@@ -9,14 +28,68 @@ class SpotifyService:
         self.redirect_uri = redirect_uri
         self.auth_url = 'https://accounts.spotify.com/authorize'
         self.token_url = 'https://accounts.spotify.com/api/token'
+        self._oauth = None
+        # user_id -> (stored token_info it was refreshed from, current token_info)
+        self._tokens = {}
+        self._user_locks = {}
+        self._lock = threading.Lock()
 
     def create_spotify_oauth(self):
-        return SpotifyOAuth(
-            client_id=self.client_id,
-            client_secret=self.client_secret,
-            redirect_uri=self.redirect_uri,
-            scope="user-library-read playlist-modify-public playlist-modify-private",
-        )
+        # Built once; it holds no per-user state since token_info is always passed in
+        with self._lock:
+            if self._oauth is None:
+                self._oauth = SpotifyOAuth(
+                    client_id=self.client_id,
+                    client_secret=self.client_secret,
+                    redirect_uri=self.redirect_uri,
+                    scope="user-library-read playlist-modify-public playlist-modify-private",
+                    requests_timeout=SPOTIFY_TIMEOUT,
+                    cache_handler=NoCacheHandler(),
+                )
+            return self._oauth
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    @staticmethod
+    def _expires_soon(token_info):
+        expires_at = token_info.get('expires_at')
+        return expires_at is None or expires_at - time.time() < TOKEN_REFRESH_MARGIN_SECONDS
+
+    def get_valid_token(self, user_id, stored_token_info):
+        """
+        Token info for `user_id` that is valid for at least
+        TOKEN_REFRESH_MARGIN_SECONDS, given what the tokens table holds.
+        Returns (token_info, changed); write token_info to the tokens table
+        only if `changed`.
+
+        Tokens are cached per user. Concurrent calls for the same user share a
+        single refresh: the others wait for it and get its result. A stored
+        token that differs from the one the cache was refreshed from (the user
+        logged in again) replaces the cached one. Raises SpotifyOauthError if
+        the refresh token is rejected.
+        """
+        with self._user_lock(user_id):
+            cached = self._tokens.get(user_id)
+            token_info = stored_token_info
+            if cached and stored_token_info in cached:
+                token_info = cached[1]
+
+            if self._expires_soon(token_info) and token_info.get('refresh_token'):
+                refreshed = self.create_spotify_oauth().refresh_access_token(
+                    token_info['refresh_token'])
+                # Spotify only sometimes issues a new refresh token
+                refreshed.setdefault('refresh_token', token_info['refresh_token'])
+                token_info = refreshed
+
+            self._tokens[user_id] = (stored_token_info, token_info)
+            return token_info, token_info != stored_token_info
+
+    def store_token(self, user_id, token_info):
+        """ Use `token_info` for `user_id` from now on, e.g. after the user logged in again. """
+        with self._user_lock(user_id):
+            self._tokens[user_id] = (token_info, token_info)
 
     def refresh_token_if_expired(self, token_info):
         sp_oauth = self.create_spotify_oauth()
@@ -25,8 +98,8 @@ class SpotifyService:
                 token_info['refresh_token'])
         return token_info
 
-    def create_spotify_client(self, token_info):
-        return spotipy.Spotify(auth=token_info['access_token'])
+    def create_spotify_client(self, token_info, **kwargs):
+        return create_spotify_client(token_info['access_token'], **kwargs)
 
     def get_auth_url(self):
         sp_oauth = self.create_spotify_oauth()
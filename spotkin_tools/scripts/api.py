@@ -1,10 +1,20 @@
 import os
 import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import spotipy
 from spotipy import SpotifyOAuth, Spotify
 try:
+    from scripts.artist_genre_cache import get_artist_genre_cache
+    from scripts.bans import PLAYLIST_TRACK_FIELDS
+    from scripts.playlist_cache import get_playlist_cache
+    from scripts.spotify_client import create_spotify_client
     from scripts.utils import *
 except:
+    from spotkin_tools.scripts.artist_genre_cache import get_artist_genre_cache
+    from spotkin_tools.scripts.bans import PLAYLIST_TRACK_FIELDS
+    from spotkin_tools.scripts.playlist_cache import get_playlist_cache
+    from spotkin_tools.scripts.spotify_client import create_spotify_client
     from spotkin_tools.scripts.utils import *
 from dotenv import load_dotenv
 
@@ -33,7 +43,7 @@ def get_spotify_client(refresh_token: str = None, timeout: int = 20) -> Spotify:
         cache_path=".cache-file"  # Optional: where to store the token info
     )
 
-    client = spotipy.Spotify(auth_manager=auth_manager)
+    client = create_spotify_client(auth_manager=auth_manager, requests_timeout=timeout)
 
     print(client.current_user())
 
@@ -54,45 +64,248 @@ def get_spotify(timeout=20) -> spotipy.Spotify:
         requests_timeout=timeout,
     )
 
-    spotify = spotipy.Spotify(auth_manager=token, requests_timeout=timeout)
+    spotify = create_spotify_client(auth_manager=token, requests_timeout=timeout)
     return spotify
 
 
-def sample_playlist_tracks(spotify: spotipy.Spotify, playlist_id, limit, name):
+# Items per page when fetching playlists page by page (Spotify's maximum)
+PLAYLIST_PAGE_SIZE = 100
+# Sample by fetching only the pages that hold the sampled positions
+# instead of the whole playlist. Set to "false" to always fetch everything.
+SPARSE_SAMPLING = os.getenv("SPOTKIN_SPARSE_SAMPLING", "true").lower() != "false"
+# Ask Spotify only for the track fields the filters use (see bans.py), on
+# every page. Set to "false" to fetch full track objects.
+SLIM_PLAYLIST_FIELDS = os.getenv("SPOTKIN_SLIM_PLAYLIST_FIELDS", "true").lower() != "false"
+PLAYLIST_FIELDS = PLAYLIST_TRACK_FIELDS if SLIM_PLAYLIST_FIELDS else None
+# Pages of one playlist fetched at the same time (1 = follow `next` one page
+# at a time). Requests still go through the shared rate limiter.
+PLAYLIST_FETCH_WIDTH = int(os.getenv("SPOTKIN_PLAYLIST_FETCH_WIDTH", 4))
+
+
+def is_playable(item):
+    """ False for removed (None) tracks and local files, which have no id. """
+    return item["track"] is not None and item["track"]["id"] is not None
+
+
+def sample_playlist_tracks(spotify: spotipy.Spotify, playlist_id, limit, name, shared_playlists=None):
+    """
+    Returns up to `limit` random playable tracks from a playlist.
+
+    With `shared_playlists` (a SharedPlaylistTracks), the playlist's
+    metadata and, once enough jobs use it, its tracks are shared by every job
+    of the scheduled run.
+
+    A cached copy with the current snapshot_id is sampled directly. Otherwise,
+    random positions are picked from the playlist's total and only the pages
+    holding them are fetched, unless that would mean fetching most of the
+    playlist anyway. Then the whole playlist is fetched: into the cache if
+    one is configured, or streamed through a reservoir sampler if not.
+    """
     log(
         f"- sampling up to {limit} Spotify tracks from the playlist '{name}'... "
     )
-    all_tracks = get_playlist_tracks(spotify, playlist_id)
-    # remove tracks with None type ids
-    all_tracks = [track for track in all_tracks if track["track"]
-                  is not None and track["track"]["id"] is not None]
+    if shared_playlists is not None:
+        return shared_playlists.sample(spotify, playlist_id, limit)
+
+    metadata = spotify.playlist(playlist_id, fields="snapshot_id,tracks.total")
+    snapshot_id = metadata["snapshot_id"]
+
+    cached_tracks = get_cached_playlist_tracks(playlist_id, snapshot_id)
+    if cached_tracks is None and SPARSE_SAMPLING:
+        sampled = sample_playlist_pages(
+            spotify, playlist_id, limit, metadata["tracks"]["total"])
+        if sampled is not None:
+            return sampled
+
+    if cached_tracks is None and get_playlist_cache() is None:
+        # Nothing to cache, so keep only the sample while the pages stream in
+        return reservoir_sample(iter_playlist_tracks(spotify, playlist_id), limit)
+
+    all_tracks = cached_tracks
+    if all_tracks is None:
+        all_tracks = get_playlist_tracks(spotify, playlist_id, snapshot_id=snapshot_id)
+    all_tracks = [track for track in all_tracks if is_playable(track)]
     return random.sample(all_tracks, min(limit, len(all_tracks)))
 
 
-def get_playlist_tracks(spotify: spotipy.Spotify, playlist_id):
+def reservoir_sample(items, limit):
+    """
+    Uniformly samples up to `limit` playable items from an iterable in one
+    pass, holding no more than `limit` items at a time.
+    """
+    reservoir = []
+    seen = 0
+    for item in items:
+        if not is_playable(item):
+            continue
+        seen += 1
+        if len(reservoir) < limit:
+            reservoir.append(item)
+        else:
+            i = random.randrange(seen)
+            if i < limit:
+                reservoir[i] = item
+    random.shuffle(reservoir)
+    return reservoir
+
+
+def sample_playlist_pages(spotify: spotipy.Spotify, playlist_id, limit, total):
+    """
+    Samples `limit` tracks by fetching only the pages that contain randomly
+    chosen positions. A few extra positions are drawn to stand in for removed
+    tracks and local files.
+
+    Returns None when the sample can't be taken this way: when it would need
+    more than half of the playlist's pages, or when too many of the drawn
+    positions turn out to be unplayable.
+    """
+    if limit < 1 or total < 1:
+        return []
+
+    page_count = -(-total // PLAYLIST_PAGE_SIZE)
+    extra = max(2, limit // 4)
+    # random.sample returns positions in random order, so keeping the first
+    # `limit` playable ones is still a uniform sample
+    positions = random.sample(range(total), min(total, limit + extra))
+    pages = sorted({position // PLAYLIST_PAGE_SIZE for position in positions})
+    if page_count > 1 and len(pages) * 2 > page_count:
+        return None
+
+    items = {}
+    for page in pages:
+        offset = page * PLAYLIST_PAGE_SIZE
+        results = spotify.playlist_items(
+            playlist_id, fields=PLAYLIST_FIELDS, limit=PLAYLIST_PAGE_SIZE, offset=offset,
+            additional_types=("track",))
+        for i, item in enumerate(results["items"]):
+            items[offset + i] = item
+
+    sampled = [items[position] for position in positions
+               if position in items and is_playable(items[position])][:limit]
+    if len(sampled) < min(limit, total) and len(positions) < total:
+        log(f"- too many unplayable tracks in playlist {playlist_id}, fetching all of it")
+        return None
+
+    log(f"- sampled {len(sampled)} tracks from {len(pages)} of {page_count} pages")
+    return sampled
+
+
+def get_cached_playlist_tracks(playlist_id, snapshot_id):
+    """ The cached tracks of a playlist if they are as of `snapshot_id`, otherwise None. """
+    cache = get_playlist_cache()
+    cached = cache.get(playlist_id) if cache is not None else None
+    if cached is None or cached[0] != snapshot_id:
+        return None
+    log(f"- playlist {playlist_id} unchanged since it was cached, skipping fetch")
+    return list(cached[1])
+
+
+def get_playlist_tracks(spotify: spotipy.Spotify, playlist_id, snapshot_id=None):
     """
     Returns all tracks in a given playlist.
+
+    If a playlist cache is configured (see playlist_cache.py), the stored
+    tracks are returned as long as the playlist's snapshot_id hasn't changed.
+    Otherwise every page is fetched and stored. Pass `snapshot_id` if it is
+    already known to save a request.
     """
-    results = spotify.playlist_tracks(playlist_id)
-    tracks = results["items"]
-    while results["next"]:
-        results = spotify.next(results)
-        tracks.extend(results["items"])
-    return tracks
+    cache = get_playlist_cache()
+    if cache is None:
+        return fetch_playlist_tracks(spotify, playlist_id)
+
+    if snapshot_id is None:
+        snapshot_id = spotify.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+    cached_tracks = get_cached_playlist_tracks(playlist_id, snapshot_id)
+    if cached_tracks is not None:
+        return cached_tracks
+
+    tracks = fetch_playlist_tracks(spotify, playlist_id)
+    cache.set(playlist_id, snapshot_id, tracks)
+    return list(tracks)
+
+
+def fetch_playlist_tracks(spotify: spotipy.Spotify, playlist_id):
+    """
+    Fetches every page of a playlist's tracks from Spotify.
+    """
+    return list(iter_playlist_tracks(spotify, playlist_id))
+
+
+def iter_playlist_tracks(spotify: spotipy.Spotify, playlist_id):
+    """
+    Yields a playlist's items in order, page by page.
+
+    The first page gives the playlist's total; the remaining pages are then
+    requested by offset, PLAYLIST_FETCH_WIDTH at a time, and yielded in
+    order. At most that many pages are held besides the one being yielded.
+    """
+    def fetch_page(offset):
+        return spotify.playlist_items(
+            playlist_id, fields=PLAYLIST_FIELDS, limit=PLAYLIST_PAGE_SIZE, offset=offset,
+            additional_types=("track",))
+
+    results = fetch_page(0)
+    yield from results["items"]
+    if not results["next"]:
+        return
+
+    offsets = iter(range(PLAYLIST_PAGE_SIZE, results["total"], PLAYLIST_PAGE_SIZE))
+    if PLAYLIST_FETCH_WIDTH <= 1:
+        for offset in offsets:
+            yield from fetch_page(offset)["items"]
+        return
+
+    pool = ThreadPoolExecutor(max_workers=PLAYLIST_FETCH_WIDTH)
+    try:
+        pending = deque(pool.submit(fetch_page, offset)
+                        for _, offset in zip(range(PLAYLIST_FETCH_WIDTH), offsets))
+        while pending:
+            page = pending.popleft().result()
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(pool.submit(fetch_page, offset))
+            yield from page["items"]
+    finally:
+        # Stop fetching if the caller stops reading early
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 def get_artists_genres(spotify: spotipy.Spotify, artist_ids):
+    """
+    Returns [{"artist_id": ..., "genres": [...]}] for the given artists.
+    Artists in the artist genre cache (see artist_genre_cache.py) are served
+    from it; only the rest are fetched from Spotify, 50 per request.
+    """
     log("- returning artist genres for artist ids...")
-    chunks = divide_chunks(artist_ids, 50)
-    artist_genres = []
-    for chunk in chunks:
+    cache = get_artist_genre_cache()
+    genres_by_artist = cache.get_many(artist_ids) if cache is not None else {}
+    missing = [artist_id for artist_id in artist_ids if artist_id not in genres_by_artist]
+    log(f"- {len(artist_ids) - len(missing)} artists' genres cached, fetching {len(missing)}")
+
+    fetched = {}
+    for chunk in divide_chunks(missing, 50):
         result = spotify.artists(chunk)["artists"]
         for item in result:
-            artist_id = item["id"]
-            genres = item["genres"]
-            artist_genre_object = {"artist_id": artist_id, "genres": genres}
-            artist_genres.append(artist_genre_object)
-    return artist_genres
+            # Unknown ids come back as None
+            if item is not None:
+                fetched[item["id"]] = item["genres"]
+    if cache is not None and fetched:
+        cache.set_many(fetched)
+    genres_by_artist.update(fetched)
+
+    return [{"artist_id": artist_id, "genres": genres_by_artist[artist_id]}
+            for artist_id in artist_ids if artist_id in genres_by_artist]
+
+
+def get_tracks(spotify: spotipy.Spotify, track_ids):
+    """
+    Returns full track objects for the given ids, in order, fetched 50 per
+    request. Ids Spotify doesn't know are left out.
+    """
+    tracks = []
+    for chunk in divide_chunks(list(track_ids), 50):
+        tracks.extend(track for track in spotify.tracks(chunk)["tracks"] if track is not None)
+    return tracks
 
 
 def get_audio_features(spotify: spotipy.Spotify, track_ids):
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Artist genres rarely change; cached genres are fetched again after this long
+ARTIST_GENRES_TTL_SECONDS = int(os.getenv("ARTIST_GENRES_TTL_SECONDS", 30 * 86400))
+# Artists kept in the in-process LRU
+ARTIST_GENRES_LRU_SIZE = int(os.getenv("ARTIST_GENRES_LRU_SIZE", 20000))
+
+
+class ArtistGenreCache:
+    """
+    Artist id -> genres, held in an in-process LRU in front of an optional
+    persistent `store`. Entries older than `ttl_seconds` count as misses, so
+    they are fetched from Spotify again and overwritten.
+
+    A store has load(artist_ids), returning {artist_id: (genres, fetched_at)}
+    for the ids it has, and save(entries) taking the same shape.
+    """
+
+    def __init__(self, store=None, ttl_seconds=ARTIST_GENRES_TTL_SECONDS, max_size=ARTIST_GENRES_LRU_SIZE):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, fetched_at, now):
+        return now - fetched_at < self.ttl_seconds
+
+    def get_many(self, artist_ids):
+        """ Genres of the given artists that are cached and fresh, as {artist_id: genres}. """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for artist_id in artist_ids:
+                entry = self._entries.get(artist_id)
+                if entry is not None and self._is_fresh(entry[1], now):
+                    self._entries.move_to_end(artist_id)
+                    found[artist_id] = entry[0]
+
+        missing = [artist_id for artist_id in artist_ids if artist_id not in found]
+        if self.store is not None and missing:
+            loaded = {artist_id: entry for artist_id, entry in self.store.load(missing).items()
+                      if self._is_fresh(entry[1], now)}
+            self._remember(loaded)
+            found.update({artist_id: entry[0] for artist_id, entry in loaded.items()})
+
+        return found
+
+    def set_many(self, genres_by_artist):
+        """ Cache freshly fetched {artist_id: genres}. """
+        entries = {artist_id: (genres, int(time.time()))
+                   for artist_id, genres in genres_by_artist.items()}
+        self._remember(entries)
+        if self.store is not None and entries:
+            self.store.save(entries)
+
+    def _remember(self, entries):
+        with self._lock:
+            for artist_id, entry in entries.items():
+                self._entries[artist_id] = entry
+                self._entries.move_to_end(artist_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_artist_genre_cache = ArtistGenreCache()
+
+
+def set_artist_genre_cache(cache):
+    """ Use `cache` for every artist genre lookup in this process. Pass None to turn caching off. """
+    global _artist_genre_cache
+    _artist_genre_cache = cache
+
+
+def get_artist_genre_cache():
+    return _artist_genre_cache
@@ -1,52 +1,134 @@
+from collections import Counter, namedtuple
+from operator import itemgetter
 try:
     from scripts.utils import *
 except:
     from spotkin_tools.scripts.utils import *
 
+# Spotify `fields` projection for playlist pages: only what process_job and
+# the rules below read (track id, name, uri and explicit flag, the artists'
+# ids and names, the album id), plus the paging keys. Add to it when a rule
+# starts reading another track field.
+PLAYLIST_TRACK_FIELDS = "total,next,items(track(id,name,uri,explicit,artists(id,name),album(id)))"
+
+
+# What the filter rules may look at for one track
+TrackInfo = namedtuple(
+    "TrackInfo", "artist_genres album_id artist_id artist_name track_name track track_id")
+
 
 class FilterTool:
-    """Determines whether songs belong in the playlist or not based on a job."""
+    """
+    Determines whether songs belong in the playlist or not based on a job.
+
+    The job's bans are compiled once: banned ids into frozensets, flags into
+    booleans, and the rules the job actually uses into `self.rules`, in the
+    order is_banned() checks them. Each check per track is then O(1).
+
+    is_banned_batch() walks the same rules for a whole list of tracks,
+    without logging each removed track.
+    """
 
     def __init__(self, job) -> None:
         self.job = job
+        self.banned_artist_ids = frozenset(x["id"] for x in job.get("banned_artists") or [])
+        self.banned_album_ids = frozenset(x["id"] for x in job.get("banned_albums") or [])
+        self.banned_track_ids = frozenset(x["id"] for x in job.get("banned_tracks") or [])
+        self.banned_genres = frozenset(job.get("banned_genres") or [])
+        self.genre_exceptions = frozenset(job.get("exceptions_to_banned_genres") or [])
+        self.ban_skits = bool(job.get("ban_skits"))
+        # Explicit lyrics are allowed unless banExplicitLyrics is exactly true
+        self.ban_explicit = job.get("banExplicitLyrics") is True
+        self.rules = self._compile_rules()
+
+    def _compile_rules(self):
+        """
+        The active rules as (reason, rule) pairs. Each rule takes a TrackInfo
+        and `quiet`, which keeps it from logging the track it removes.
+        """
+        rules = [
+            ("genre", self.banned_genres, self._is_banned_by_genre, ("artist_genres", "artist_name", "track_name")),
+            ("skit", self.ban_skits, self._is_banned_by_skit, ("track_name", "artist_name")),
+            ("explicit", self.ban_explicit, self._is_banned_by_explicit_lyrics, ("track_name", "artist_name", "track")),
+            ("album", self.banned_album_ids, self.is_banned_by_album_id, ("album_id", "artist_name", "track_name")),
+            ("artist", self.banned_artist_ids, self._is_banned_by_artist_id, ("artist_id", "track_name")),
+            ("track", self.banned_track_ids, self._is_banned_by_track_id, ("track_id", "artist_name", "track_name")),
+        ]
+        # Audio features are not checked any more (see _is_banned_by_audio_features)
+        return [(reason, self._bind_rule(method, fields)) for reason, active, method, fields in rules if active]
+
+    @staticmethod
+    def _bind_rule(method, fields):
+        """ Adapts a rule method to take a TrackInfo, passing it the named `fields` and `quiet`. """
+        get_args = itemgetter(*(TrackInfo._fields.index(field) for field in fields))
+        if len(fields) == 1:
+            return lambda track_info, quiet: method(get_args(track_info), quiet)
+        return lambda track_info, quiet: method(*get_args(track_info), quiet)
+
+    def _banned_by(self, track_info, quiet=False):
+        """ The reason of the first rule that bans a track, or None. """
+        for reason, rule in self.rules:
+            if rule(track_info, quiet):
+                return reason
+        return None
+
+    def required_enrichments(self):
+        """
+        The extra per-track data the job's active rules need, so callers only
+        fetch that: "artist_genres" when the job bans any genres. Audio
+        features are never needed since no rule checks them any more.
+        """
+        enrichments = set()
+        if self.job.get("banned_genres"):
+            enrichments.add("artist_genres")
+        return enrichments
 
     def is_banned(self, artist_genres=[], album_id=None, artist_id=None, artist_name=None, track_name=None, track=None, track_id=None,  audio_features=None, ban_skits=False):
-        return self._is_banned_by_genre(artist_genres, artist_name, track_name) or \
-            self._is_banned_by_skit(track_name, artist_name) or \
-            self._is_banned_by_audio_features(
-                track_name, artist_name, track, audio_features) or \
-            self._is_banned_by_explicit_lyrics(track_name, artist_name, track) or \
-            self.is_banned_by_album_id(album_id, artist_name, track_name) or \
-            self._is_banned_by_artist_id(artist_id, track_name) or \
-            self._is_banned_by_track_id(track_id, artist_name, track_name)
-
-    def _is_banned_by_artist_id(self, artist_id, track_name):
-        # print("_is_banned_by_artist_id")
-
-        if "banned_artists" not in self.job:
-            return False
-
-        banned_artists = [x["id"] for x in self.job["banned_artists"]]
-
-        if artist_id and artist_id in banned_artists:
-            log(
-                f"Removed {track_name} because {artist_id} is in this playlist's banned artist ids"
-            )
+        return self._banned_by(TrackInfo(
+            artist_genres, album_id, artist_id, artist_name, track_name, track, track_id)) is not None
+
+    def is_banned_batch(self, tracks, artist_genres=None):
+        """
+        Checks every track at once. `artist_genres` lists the genres of each
+        track's first artist (None where unknown), in the same order as
+        `tracks`; it is only needed when the job bans genres.
+
+        Returns (keep, reasons): `keep[i]` is False if tracks[i] is banned, and
+        `reasons[i]` is the first rule that banned it ("genre", "skit",
+        "explicit", "album", "artist" or "track"), or None. The number of
+        tracks removed for each reason is logged once.
+        """
+        if artist_genres is None:
+            artist_genres = [None] * len(tracks)
+
+        reasons = [
+            self._banned_by(TrackInfo(genres, track["album"]["id"], track["artists"][0]["id"],
+                                      track["artists"][0]["name"], track["name"], track, track["id"]), quiet=True)
+            for track, genres in zip(tracks, artist_genres)
+        ]
+        keep = [reason is None for reason in reasons]
+
+        removed = Counter(reason for reason in reasons if reason is not None)
+        if removed:
+            counts = ", ".join(f"{count} {reason}" for reason, count in removed.most_common())
+            log(f"Removed {sum(removed.values())} of {len(tracks)} tracks by rule: {counts}")
+        return keep, reasons
+
+    def _is_banned_by_artist_id(self, artist_id, track_name, quiet=False):
+        if artist_id and artist_id in self.banned_artist_ids:
+            if not quiet:
+                log(
+                    f"Removed {track_name} because {artist_id} is in this playlist's banned artist ids"
+                )
             return True
         return False
 
-    def is_banned_by_album_id(self, album_id, artist_name, track_name):
-        # print("_is_banned_by_album_id")
-
-        if "banned_albums" not in self.job:
-            return False
-
-        banned_albums = [x["id"] for x in self.job["banned_albums"]]
-
-        if album_id and album_id in banned_albums:
-            log(
-                f"Removed {track_name} by {artist_name} because {album_id} is in this playlist's banned album ids"
-            )
+    def is_banned_by_album_id(self, album_id, artist_name, track_name, quiet=False):
+        if album_id and album_id in self.banned_album_ids:
+            if not quiet:
+                log(
+                    f"Removed {track_name} by {artist_name} because {album_id} is in this playlist's banned album ids"
+                )
             return True
         return False
 
@@ -79,48 +161,49 @@ class FilterTool:
         # If no condition bans the track
         return False
 
-    def _is_banned_by_genre(self, artist_genres, artist_name, track_name):
-        # print("_is_banned_by_genre")
-
-        if "banned_genres" not in self.job or self.job["banned_genres"] is None or artist_genres is None:
+    def _is_banned_by_genre(self, artist_genres, artist_name, track_name, quiet=False):
+        if not self.banned_genres or artist_genres is None:
             return False
 
         # want to try being more aggressive here.
         # Now a banned genre 'rap' will reject 'Cali rap', 'trap' and 'rap metal' etc.
         elif (
             # if any of the banned genres are in the artist's genre
-            any(
-                banned_genre in artist_genres for banned_genre in self.job["banned_genres"])
-            and artist_name not in self.job["exceptions_to_banned_genres"]
+            not self.banned_genres.isdisjoint(artist_genres)
+            and artist_name not in self.genre_exceptions
         ):
-            log(
-                f"Removed {track_name} by {artist_name} because genre {artist_genres} is in this playlist's banned genres"
-            )
+            if not quiet:
+                log(
+                    f"Removed {track_name} by {artist_name} because genre {artist_genres} is in this playlist's banned genres"
+                )
             return True
         return False
 
-    def _is_banned_by_skit(self, track_name, artist_name):
+    def _is_banned_by_skit(self, track_name, artist_name, quiet=False):
         """ Check if the track is a skit """
 
-        if "ban_skits" not in self.job or not self.job["ban_skits"]:
+        if not self.ban_skits:
             return False
 
         elif "skit" in track_name.lower():
-            log(
-                f"Removed {track_name} by {artist_name} because it is a skit"
-            )
+            if not quiet:
+                log(
+                    f"Removed {track_name} by {artist_name} because it is a skit"
+                )
             return True
-            
-    def _is_banned_by_explicit_lyrics(self, track_name, artist_name, track):
+        return False
+
+    def _is_banned_by_explicit_lyrics(self, track_name, artist_name, track, quiet=False):
         """ Check if the track has explicit lyrics and should be banned """
         
         # Default is to allow explicit lyrics (banExplicitLyrics=false), so only ban if explicitly set to true
-        if "banExplicitLyrics" not in self.job or self.job["banExplicitLyrics"] is not True:
+        if not self.ban_explicit:
             return False
             
         # Check if the track is marked as explicit in Spotify
         if track and track.get("explicit", False):
-            log(f"Removed {track_name} by {artist_name} because it contains explicit lyrics")
+            if not quiet:
+                log(f"Removed {track_name} by {artist_name} because it contains explicit lyrics")
             return True
             
         return False
@@ -141,18 +224,12 @@ class FilterTool:
     #         return True
     #     return False
 
-    def _is_banned_by_track_id(self, track_id, artist_name, track_name):
-        # print("_is_banned_by_track_id")
-
-        if "banned_tracks" not in self.job:
-            return False
-
-        banned_tracks = [x["id"] for x in self.job["banned_tracks"]]
-
-        if track_id in banned_tracks:
-            log(
-                f"Removed {track_name} by {artist_name} because {track_id} is in this playlist's banned track_ids"
-            )
+    def _is_banned_by_track_id(self, track_id, artist_name, track_name, quiet=False):
+        if track_id in self.banned_track_ids:
+            if not quiet:
+                log(
+                    f"Removed {track_name} by {artist_name} because {track_id} is in this playlist's banned track_ids"
+                )
             return True
         return False
 
@@ -0,0 +1,304 @@
+import http.client
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import parse_qs, urlencode, urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+try:
+    from scripts.spotify_client import endpoint_name, get_session
+except:
+    from spotkin_tools.scripts.spotify_client import endpoint_name, get_session
+
+API_PREFIX = "https://api.spotify.com/v1/"
+
+
+def parse_fields(fields):
+    """ Spotify's `fields` syntax ("tracks.total,items(track(id,name))") as a nested dict. """
+    def add(tree, name, subtree):
+        *parents, leaf = name.split(".")
+        for parent in parents:
+            tree = tree.setdefault(parent, {})
+        tree[leaf] = subtree
+
+    def parse(i):
+        tree, name = {}, ""
+        while i < len(fields):
+            char = fields[i]
+            if char == "(":
+                subtree, i = parse(i + 1)
+                add(tree, name, subtree)
+                name = ""
+            elif char == ")":
+                break
+            elif char == ",":
+                if name:
+                    add(tree, name, None)
+                name = ""
+            else:
+                name += char
+            i += 1
+        if name:
+            add(tree, name, None)
+        return tree, i
+    return parse(0)[0]
+
+
+def project(value, tree):
+    """ Keep only the fields in `tree` (from parse_fields), applied to every item of lists. """
+    if tree is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+
+class FakeSpotify:
+    """
+    In-memory stand-in for the parts of the Spotify Web API this project
+    uses, for benchmarking without a network or a Spotify account.
+
+    Playlists are synthetic: any playlist id that hasn't been added with
+    add_playlist() holds `playlist_size` tracks drawn deterministically from
+    a pool of `track_pool` tracks, so popular ids overlap across recipes the
+    way real sources do. Writes change the playlist and its snapshot_id.
+
+    Every request sleeps `latency` seconds (plus up to `latency_jitter`), and
+    a `rate_limit_ratio` share of them is answered with a 429 and a
+    Retry-After of `retry_after` seconds. `unplayable_ratio` of playlist items
+    are removed tracks (track: null). Playlist pages honour `fields`.
+    """
+
+    def __init__(self, playlist_size=1000, track_pool=100000, artist_pool=5000, latency=0.0,
+                 latency_jitter=0.0, rate_limit_ratio=0.0, retry_after=1, unplayable_ratio=0.0, seed=0):
+        self.playlist_size = playlist_size
+        self.track_pool = track_pool
+        self.artist_pool = artist_pool
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.unplayable_ratio = unplayable_ratio
+        self.random = random.Random(seed)
+        self.playlists = {}
+        self.versions = Counter()
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.response_bytes = 0
+        self.lock = threading.Lock()
+
+    # Synthetic catalogue
+
+    def add_playlist(self, playlist_id, size=None, track_ids=None):
+        """ Add a playlist holding `track_ids`, or `size` synthetic tracks. """
+        if track_ids is None:
+            track_ids = [self._pick_track(playlist_id, i) for i in range(size or 0)]
+        with self.lock:
+            self.playlists[playlist_id] = list(track_ids)
+
+    def _pick_track(self, playlist_id, index):
+        if self.unplayable_ratio and zlib.crc32(f"{playlist_id}:{index}:local".encode()) % 1000 < self.unplayable_ratio * 1000:
+            return None
+        return f"faketrack{zlib.crc32(f'{playlist_id}:{index}'.encode()) % self.track_pool}"
+
+    def _playlist_track_ids(self, playlist_id):
+        with self.lock:
+            if playlist_id not in self.playlists:
+                self.playlists[playlist_id] = [
+                    self._pick_track(playlist_id, i) for i in range(self.playlist_size)]
+            return self.playlists[playlist_id]
+
+    def _snapshot_id(self, playlist_id):
+        return f"{playlist_id}-{self.versions[playlist_id]}"
+
+    @staticmethod
+    def _number(item_id):
+        return zlib.crc32(item_id.encode())
+
+    def artist(self, artist_id):
+        n = self._number(artist_id)
+        return {
+            "id": artist_id,
+            "name": f"Artist {artist_id}",
+            "uri": f"spotify:artist:{artist_id}",
+            "genres": [f"genre {n % 40}", f"genre {n % 97}"] if n % 10 else [],
+            "popularity": n % 100,
+        }
+
+    def track(self, track_id):
+        n = self._number(track_id)
+        artist_id = f"fakeartist{n % self.artist_pool}"
+        album_id = f"fakealbum{n % (self.artist_pool * 3)}"
+        return {
+            "id": track_id,
+            "name": f"Track {track_id}" if n % 50 else f"Skit {track_id}",
+            "uri": f"spotify:track:{track_id}",
+            "explicit": n % 7 == 0,
+            "duration_ms": 120000 + n % 180000,
+            "popularity": n % 100,
+            "artists": [{"id": artist_id, "name": f"Artist {artist_id}", "uri": f"spotify:artist:{artist_id}"}],
+            "album": {"id": album_id, "name": f"Album {album_id}", "uri": f"spotify:album:{album_id}",
+                      "images": [{"url": f"https://example.com/{album_id}.jpg", "height": 640, "width": 640}]},
+            "available_markets": ["US", "GB", "DE", "FR", "JP"],
+        }
+
+    def _playlist(self, playlist_id):
+        track_ids = self._playlist_track_ids(playlist_id)
+        return {
+            "id": playlist_id,
+            "name": f"Playlist {playlist_id}",
+            "uri": f"spotify:playlist:{playlist_id}",
+            "owner": {"id": "spotify"},
+            "images": [],
+            "description": "",
+            "snapshot_id": self._snapshot_id(playlist_id),
+            "tracks": {"total": len(track_ids)},
+        }
+
+    def _page(self, url, items, total, offset, limit, key=None, query=None):
+        next_url = None
+        if offset + limit < total:
+            # Like Spotify, keep the other query parameters (fields, market...)
+            next_url = f"{url}?{urlencode({**(query or {}), 'offset': offset + limit, 'limit': limit})}"
+        page = {"items": items, "total": total, "offset": offset, "limit": limit, "next": next_url}
+        return {key: page} if key else page
+
+    # Request handling
+
+    def handle(self, method, url, body):
+        """ Returns (status, json body or None, headers) for one request. """
+        parts = urlsplit(url)
+        path = parts.path[len("/v1/"):].strip("/").split("/")
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        base_url = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        ids = [item_id for item_id in query.get("ids", "").split(",") if item_id]
+
+        if path == ["me"]:
+            return 200, {"id": "fakeuser", "display_name": "Fake User"}, {}
+
+        if path[0] == "playlists" and len(path) >= 2:
+            playlist_id = path[1]
+            if len(path) == 2 and method == "GET":
+                playlist = self._playlist(playlist_id)
+                if "fields" in query:
+                    playlist = project(playlist, parse_fields(query["fields"]))
+                return 200, playlist, {}
+            if len(path) == 2 and method == "PUT":
+                return 200, None, {}
+            # Newer spotipy versions use /items, older ones /tracks
+            if path[2:] in (["tracks"], ["items"]):
+                track_ids = self._playlist_track_ids(playlist_id)
+                if method == "GET":
+                    items = [{"added_at": "2024-01-01T00:00:00Z", "is_local": False,
+                              "track": self.track(track_id) if track_id else None}
+                             for track_id in track_ids[offset:offset + limit]]
+                    page = self._page(base_url, items, len(track_ids), offset, limit, query=query)
+                    if "fields" in query:
+                        page = project(page, parse_fields(query["fields"]))
+                    return 200, page, {}
+                uris = json.loads(body or "{}").get("uris", [])
+                new_ids = [uri.split(":")[-1] for uri in uris]
+                with self.lock:
+                    if method == "PUT":
+                        self.playlists[playlist_id] = new_ids
+                    else:
+                        self.playlists[playlist_id] = track_ids + new_ids
+                    self.versions[playlist_id] += 1
+                    return 201 if method == "POST" else 200, {"snapshot_id": self._snapshot_id(playlist_id)}, {}
+
+        if path == ["artists"]:
+            return 200, {"artists": [self.artist(artist_id) for artist_id in ids]}, {}
+        if path[0] == "artists" and len(path) == 2:
+            return 200, self.artist(path[1]), {}
+        if path[0] == "artists" and path[2:] == ["top-tracks"]:
+            n = self._number(path[1])
+            return 200, {"tracks": [self.track(f"faketrack{(n + i) % self.track_pool}") for i in range(10)]}, {}
+        if path[0] == "artists" and path[2:] == ["related-artists"]:
+            n = self._number(path[1])
+            return 200, {"artists": [self.artist(f"fakeartist{(n + i) % self.artist_pool}") for i in range(1, 21)]}, {}
+
+        if path == ["tracks"]:
+            return 200, {"tracks": [self.track(track_id) for track_id in ids]}, {}
+        if path[0] == "tracks" and len(path) == 2:
+            return 200, self.track(path[1]), {}
+
+        if path[0] == "albums" and len(path) >= 2:
+            n = self._number(path[1])
+            track_ids = [f"faketrack{(n + i) % self.track_pool}" for i in range(12)]
+            items = [{key: value for key, value in self.track(track_id).items() if key != "album"}
+                     for track_id in track_ids]
+            tracks_url = f"{API_PREFIX}albums/{path[1]}/tracks"
+            page = self._page(tracks_url, items[offset:offset + limit], len(items), offset, limit)
+            if path[2:] == ["tracks"]:
+                return 200, page, {}
+            first_page = self._page(tracks_url, items[:50], len(items), 0, 50)
+            return 200, {"id": path[1], "name": f"Album {path[1]}", "uri": f"spotify:album:{path[1]}",
+                         "artists": [self.artist(f"fakeartist{n % self.artist_pool}")], "tracks": first_page}, {}
+
+        if path == ["search"]:
+            q = query.get("q", "")
+            playlists = [{**self._playlist(f"fakesearch{self._number(q) % 1000}{i}"), "name": f"{q} {i}"}
+                         for i in range(limit)]
+            return 200, self._page(base_url, playlists, limit, 0, limit, key="playlists"), {}
+
+        return 404, {"error": {"status": 404, "message": f"Fake Spotify has no {method} {parts.path}"}}, {}
+
+    def stats(self):
+        with self.lock:
+            return {"requests": sum(self.requests.values()), "rate_limited": self.rate_limited,
+                    "response_bytes": self.response_bytes, "by_endpoint": dict(self.requests.most_common())}
+
+
+class FakeSpotifyAdapter(requests.adapters.BaseAdapter):
+    """ requests transport adapter that answers Spotify API calls from a FakeSpotify. """
+
+    def __init__(self, fake):
+        super().__init__()
+        self.fake = fake
+
+    def send(self, request, **kwargs):
+        fake = self.fake
+        with fake.lock:
+            fake.requests[endpoint_name(request.method, request.url)] += 1
+            rate_limited = fake.random.random() < fake.rate_limit_ratio
+            delay = fake.latency + fake.random.random() * fake.latency_jitter
+        if delay:
+            time.sleep(delay)
+
+        if rate_limited:
+            with fake.lock:
+                fake.rate_limited += 1
+            status, body, headers = 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}, {
+                "Retry-After": str(fake.retry_after)}
+        else:
+            status, body, headers = fake.handle(request.method, request.url, request.body)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.client.responses.get(status, "")
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json", **headers})
+        response._content = json.dumps(body).encode() if body is not None else b""
+        with fake.lock:
+            fake.response_bytes += len(response._content)
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def install_fake_spotify(fake=None, session=None):
+    """
+    Route every Spotify API call made through the shared session (or
+    `session`) to `fake` instead of the network. Returns the FakeSpotify.
+    """
+    fake = fake or FakeSpotify()
+    (session or get_session()).mount(API_PREFIX, FakeSpotifyAdapter(fake))
+    return fake
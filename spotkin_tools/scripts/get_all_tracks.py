@@ -10,15 +10,19 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 def get_playlist_tracks_wrapper(args):
-    spotify, playlist_id, quantity, playlist_name = args
+    spotify, playlist_id, quantity, playlist_name, shared_playlists = args
     log(f"spotify object: {spotify.__class__.__name__}")
-    return sample_playlist_tracks(spotify, playlist_id, quantity, name=playlist_name)
+    return sample_playlist_tracks(spotify, playlist_id, quantity, name=playlist_name,
+                                  shared_playlists=shared_playlists)
 
 
-def get_all_tracks(job, spotify):
+def get_all_tracks(job, spotify, shared_playlists=None):
     """
     This function will get the tracks from the playlists the user has specified
     using parallel processing to speed up execution.
+
+    Pass `shared_playlists` to sample from playlists shared across the jobs
+    of a scheduled run.
     """
     target_playlist_name = job["name"]
     log(
@@ -36,7 +40,7 @@ def get_all_tracks(job, spotify):
         playlist_id = row["source_playlist_id"]
         playlist_name = row["source_playlist_name"]
 
-        tasks.append((spotify, playlist_id, quantity, playlist_name))
+        tasks.append((spotify, playlist_id, quantity, playlist_name, shared_playlists))
 
     # Use ThreadPoolExecutor for parallel execution
     with ThreadPoolExecutor(max_workers=10) as executor:
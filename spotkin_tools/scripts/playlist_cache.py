@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+try:
+    from scripts.utils import log
+except:
+    from spotkin_tools.scripts.utils import log
+
+
+class PlaylistTrackCache:
+    """
+    Stores the items of source playlists together with the snapshot_id they
+    were fetched at. A playlist's snapshot_id changes whenever its contents
+    change, so a stored copy with the current snapshot_id is still exact.
+
+    This base class keeps everything in memory. Persistent stores override
+    get() and set().
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, playlist_id):
+        """ Return (snapshot_id, items) for a playlist, or None if it isn't stored. """
+        with self._lock:
+            return self._entries.get(playlist_id)
+
+    def set(self, playlist_id, snapshot_id, items):
+        with self._lock:
+            self._entries[playlist_id] = (snapshot_id, items)
+
+
+class FilePlaylistTrackCache(PlaylistTrackCache):
+    """ Keeps one JSON file per playlist in `directory`, for running spotkin_tools locally. """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, playlist_id):
+        return os.path.join(self.directory, f"{playlist_id}.json")
+
+    def get(self, playlist_id):
+        try:
+            with open(self._path(playlist_id), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry["snapshot_id"], entry["items"]
+
+    def set(self, playlist_id, snapshot_id, items):
+        path = self._path(playlist_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"snapshot_id": snapshot_id, "items": items}, file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log(f"Could not cache playlist {playlist_id}: {e}")
+
+
+_playlist_cache = None
+if os.getenv("SPOTKIN_PLAYLIST_CACHE_DIR"):
+    _playlist_cache = FilePlaylistTrackCache(os.getenv("SPOTKIN_PLAYLIST_CACHE_DIR"))
+
+
+def set_playlist_cache(cache):
+    """ Use `cache` for every playlist fetch in this process. Pass None to turn caching off. """
+    global _playlist_cache
+    _playlist_cache = cache
+
+
+def get_playlist_cache():
+    return _playlist_cache
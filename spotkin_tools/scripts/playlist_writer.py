@@ -0,0 +1,66 @@
+try:
+    from scripts.utils import divide_chunks, log
+except:
+    from spotkin_tools.scripts.utils import divide_chunks, log
+
+# Most items Spotify accepts in one replace or add call
+WRITE_CHUNK_SIZE = 100
+
+
+def plan_playlist_writes(track_ids, current_ids=None):
+    """
+    Returns the calls that make a playlist hold exactly `track_ids`, in order,
+    as a list of ("replace" | "add", ids) tuples: one replace carrying the
+    first 100 ids, then one add per further 100. Returns no calls when
+    `current_ids` already matches.
+    """
+    if current_ids is not None and list(current_ids) == list(track_ids):
+        return []
+
+    chunks = list(divide_chunks(list(track_ids), WRITE_CHUNK_SIZE)) or [[]]
+    return [("replace", chunks[0])] + [("add", chunk) for chunk in chunks[1:]]
+
+
+def get_current_track_ids(spotify, playlist_id, expected_ids):
+    """
+    Returns the playlist's track ids if they might equal `expected_ids`, and
+    None as soon as they can't. A playlist of a different length costs a
+    single request; pages are only read while they keep matching.
+    """
+    fields = "total,next,items(track(id))"
+    results = spotify.playlist_items(
+        playlist_id, fields=fields, limit=WRITE_CHUNK_SIZE, additional_types=("track",))
+    if results["total"] != len(expected_ids):
+        return None
+
+    current_ids = []
+    while True:
+        current_ids.extend(item["track"]["id"] if item["track"] else None for item in results["items"])
+        if current_ids != expected_ids[:len(current_ids)]:
+            return None
+        if not results["next"]:
+            return current_ids
+        results = spotify.next(results)
+
+
+def write_playlist_tracks(spotify, playlist_id, track_ids, skip_unchanged=True):
+    """
+    Makes the playlist hold `track_ids`. The playlist is never left empty in
+    between. With `skip_unchanged`, the playlist is read first (one extra
+    request) and nothing is written if it already holds them; pass False
+    when the order is random and can't be expected to match. Returns the
+    number of write calls made.
+    """
+    current_ids = get_current_track_ids(spotify, playlist_id, list(track_ids)) if skip_unchanged else None
+    writes = plan_playlist_writes(track_ids, current_ids)
+    if not writes:
+        log("Playlist already holds these tracks, skipping the write")
+        return 0
+
+    for action, chunk in writes:
+        if action == "replace":
+            spotify.playlist_replace_items(playlist_id, chunk)
+        else:
+            spotify.playlist_add_items(playlist_id, chunk)
+    log(f"Wrote {len(track_ids)} tracks in {len(writes)} calls")
+    return len(writes)
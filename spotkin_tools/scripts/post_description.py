@@ -40,6 +40,4 @@ def post_description(spotify, job):
 
     log(f"Updating playlist description: {description}")
 
-    spotify.user_playlist_change_details(
-        spotify.me()["id"], job["playlist_id"], description=description
-    )
+    spotify.playlist_change_details(job["playlist_id"], description=description)
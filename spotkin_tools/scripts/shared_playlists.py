@@ -0,0 +1,147 @@
+import random
+import threading
+try:
+    from scripts.api import (PLAYLIST_PAGE_SIZE, SPARSE_SAMPLING, get_cached_playlist_tracks,
+                             get_playlist_tracks, is_playable, sample_playlist_pages)
+    from scripts.utils import log
+except:
+    from spotkin_tools.scripts.api import (PLAYLIST_PAGE_SIZE, SPARSE_SAMPLING, get_cached_playlist_tracks,
+                                           get_playlist_tracks, is_playable, sample_playlist_pages)
+    from spotkin_tools.scripts.utils import log
+
+
+def sparse_sample_cost(total, limit):
+    """ Most page requests sample_playlist_pages() makes for `limit` tracks out of `total`. """
+    page_count = -(-total // PLAYLIST_PAGE_SIZE)
+    return min(page_count, limit + max(2, limit // 4))
+
+
+class _CountedSpotify:
+    """ Passes calls through to a Spotify client, reporting each playlist request to `count`. """
+
+    REQUEST_METHODS = frozenset(('playlist', 'playlist_items', 'playlist_tracks'))
+
+    def __init__(self, spotify, count):
+        self._spotify = spotify
+        self._count = count
+
+    def __getattr__(self, name):
+        attr = getattr(self._spotify, name)
+        if name not in self.REQUEST_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._count(requests=1)
+            return attr(*args, **kwargs)
+        return counted
+
+
+class SharedPlaylistTracks:
+    """
+    Source playlists shared by every job of a scheduled run.
+
+    Each playlist's metadata (snapshot_id and size) is fetched once per run.
+    A playlist found in the playlist cache is shared straight away. Otherwise
+    jobs keep sampling only the pages they need until the pages spent that way
+    would have paid for fetching the whole playlist; the playlist is then
+    fetched once and every later job samples from the shared copy without any
+    request. So a source used by one job costs no more than without sharing,
+    and a popular one costs about one full fetch per run.
+
+    Loads are single-flight: jobs that need a playlist while it is being
+    loaded wait for that load. Create one per run so playlists are never more
+    than a run old.
+
+    `requests` counts the playlist requests actually made; `requests_saved`
+    estimates the ones jobs would have made without sharing.
+    """
+
+    def __init__(self):
+        self._playlists = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.requests = 0
+        self.requests_saved = 0
+
+    def _count(self, lookups=0, hits=0, requests=0, requests_saved=0):
+        with self._lock:
+            self.lookups += lookups
+            self.hits += hits
+            self.requests += requests
+            self.requests_saved += requests_saved
+
+    def _playlist(self, playlist_id):
+        with self._lock:
+            return self._playlists.setdefault(playlist_id, {
+                'lock': threading.Lock(),
+                'snapshot_id': None,
+                'total': None,
+                'tracks': None,
+                'spent': 0,
+            })
+
+    def sample(self, spotify, playlist_id, limit):
+        """ Up to `limit` random playable tracks of a playlist. """
+        self._count(lookups=1)
+        playlist = self._playlist(playlist_id)
+        spotify = _CountedSpotify(spotify, self._count)
+
+        with playlist['lock']:
+            if playlist['snapshot_id'] is None:
+                metadata = spotify.playlist(playlist_id, fields="snapshot_id,tracks.total")
+                playlist['snapshot_id'] = metadata["snapshot_id"]
+                playlist['total'] = metadata["tracks"]["total"]
+            else:
+                # The metadata request this job would have made
+                self._count(requests_saved=1)
+
+            full_cost = max(1, -(-playlist['total'] // PLAYLIST_PAGE_SIZE))
+            sparse_cost = sparse_sample_cost(playlist['total'], limit)
+
+            if playlist['tracks'] is not None:
+                self._count(hits=1, requests_saved=min(sparse_cost, full_cost))
+            else:
+                tracks = get_cached_playlist_tracks(playlist_id, playlist['snapshot_id'])
+                if tracks is None and SPARSE_SAMPLING and playlist['spent'] + sparse_cost < full_cost:
+                    # Not worth fetching the whole playlist (yet)
+                    playlist['spent'] += sparse_cost
+                elif tracks is None:
+                    tracks = get_playlist_tracks(spotify, playlist_id, snapshot_id=playlist['snapshot_id'])
+                if tracks is not None:
+                    playlist['tracks'] = [track for track in tracks if is_playable(track)]
+
+            shared_tracks = playlist['tracks']
+
+        if shared_tracks is not None:
+            return random.sample(shared_tracks, min(limit, len(shared_tracks)))
+
+        sampled = sample_playlist_pages(spotify, playlist_id, limit, playlist['total'])
+        if sampled is not None:
+            return sampled
+
+        # Too many removed tracks to sample sparsely; share the whole playlist instead
+        with playlist['lock']:
+            if playlist['tracks'] is None:
+                tracks = get_playlist_tracks(spotify, playlist_id, snapshot_id=playlist['snapshot_id'])
+                playlist['tracks'] = [track for track in tracks if is_playable(track)]
+            shared_tracks = playlist['tracks']
+        return random.sample(shared_tracks, min(limit, len(shared_tracks)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'playlists': len(self._playlists),
+                'shared': sum(1 for playlist in self._playlists.values() if playlist['tracks'] is not None),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_ratio': round(self.hits / self.lookups, 3) if self.lookups else 0,
+                'requests': self.requests,
+                'requests_saved': self.requests_saved,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        log(
+            f"Shared source playlists: {stats['shared']} of {stats['playlists']} shared, {stats['hits']}/{stats['lookups']} lookups "
+            f"served from a shared copy ({stats['hit_ratio']:.0%}), about {stats['requests_saved']} requests saved")
@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+import requests
+import spotipy
+from spotipy.exceptions import SpotifyException
+from urllib3.util.retry import Retry
+try:
+    from scripts.utils import log
+except:
+    from spotkin_tools.scripts.utils import log
+
+# Process-wide Spotify request rate, shared by every client in the process.
+# Size it to the app's quota (Spotify enforces a rolling 30 second window).
+SPOTIFY_REQUESTS_PER_SECOND = float(os.getenv("SPOTIFY_REQUESTS_PER_SECOND", 10))
+SPOTIFY_BURST = int(os.getenv("SPOTIFY_BURST", 20))
+# Seconds to wait for Spotify to answer a single request
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", 10))
+# Connections kept open to api.spotify.com
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", 32))
+# How many 429 responses a single call waits out before giving up
+SPOTIFY_MAX_RATE_LIMIT_RETRIES = int(os.getenv("SPOTIFY_MAX_RATE_LIMIT_RETRIES", 5))
+# Requests a single job may make before it is aborted (0 = no limit)
+SPOTIFY_JOB_CALL_BUDGET = int(os.getenv("SPOTIFY_JOB_CALL_BUDGET", 1000))
+# Share one request between identical concurrent catalogue reads
+SPOTIFY_COALESCE_REQUESTS = os.getenv("SPOTIFY_COALESCE_REQUESTS", "true").lower() != "false"
+
+# Catalogue reads that concurrent identical requests may share one response
+# of. User-specific reads such as `me` are not listed. Some responses still
+# depend on the token, see TOKEN_SCOPED_ENDPOINTS and MARKET_SCOPED_ENDPOINTS.
+COALESCED_ENDPOINTS = frozenset([
+    'GET albums/{id}',
+    'GET albums/{id}/tracks',
+    'GET artists',
+    'GET artists/{id}',
+    'GET artists/{id}/related-artists',
+    'GET artists/{id}/top-tracks',
+    'GET playlists/{id}',
+    'GET playlists/{id}/items',
+    'GET playlists/{id}/tracks',
+    'GET search',
+    'GET tracks',
+    'GET tracks/{id}',
+])
+
+# Playlists may be private or collaborative, so what a request returns
+# depends on the token's access: only requests with the same token share
+TOKEN_SCOPED_ENDPOINTS = frozenset([
+    'GET playlists/{id}',
+    'GET playlists/{id}/items',
+    'GET playlists/{id}/tracks',
+])
+
+# Without an explicit market (or country) these follow the market of the
+# token's user, so only requests with the same token share
+MARKET_SCOPED_ENDPOINTS = frozenset([
+    'GET albums/{id}',
+    'GET albums/{id}/tracks',
+    'GET artists/{id}/top-tracks',
+    'GET search',
+    'GET tracks',
+    'GET tracks/{id}',
+])
+
+# Path segments that are followed by an id, e.g. playlists/{id}/tracks
+_ID_COLLECTIONS = frozenset(['albums', 'artists', 'audio-features', 'audiobooks', 'categories',
+                             'chapters', 'episodes', 'playlists', 'shows', 'tracks', 'users'])
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second on average, with
+    bursts of up to `capacity`. pause() stops everyone for a while, which is
+    how a 429's Retry-After is applied to the whole process.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+rate_limiter = TokenBucket(SPOTIFY_REQUESTS_PER_SECOND, SPOTIFY_BURST)
+
+
+class SpotifyCallBudgetExceeded(Exception):
+    """ A client made more requests than its CallCounter's budget allows. """
+
+    def __init__(self, message, calls=None):
+        super().__init__(message)
+        self.calls = calls
+
+
+def endpoint_name(method, url):
+    """ 'GET playlists/{id}/tracks' for any playlist's tracks URL, with or without the API prefix. """
+    path = urlsplit(url).path
+    if path.startswith('/v1/'):
+        path = path[len('/v1/'):]
+    segments = []
+    for segment in path.strip('/').split('/'):
+        segments.append('{id}' if segments and segments[-1] in _ID_COLLECTIONS else segment)
+    return f"{method} {'/'.join(segments)}"
+
+
+class CallCounter:
+    """
+    Counts the requests a client makes, by endpoint. With a `budget`, the
+    request that would exceed it raises SpotifyCallBudgetExceeded instead of
+    being sent. Rate-limited attempts count too, since they use quota.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or None
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, method, url):
+        endpoint = endpoint_name(method, url)
+        with self.lock:
+            if not self.budget or self.total < self.budget:
+                self.counts[endpoint] += 1
+                return
+        raise SpotifyCallBudgetExceeded(
+            f"Spotify call budget of {self.budget} requests exceeded (next: {endpoint})",
+            calls=self.to_dict())
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def to_dict(self):
+        with self.lock:
+            return {'total': self.total, 'by_endpoint': dict(self.counts.most_common())}
+
+    def summary(self):
+        calls = self.to_dict()
+        endpoints = ', '.join(f"{endpoint}: {count}" for endpoint, count in calls['by_endpoint'].items())
+        return f"{calls['total']} Spotify requests ({endpoints})"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The pooled HTTP session shared by every Spotify client in the process.
+    Connection errors and 5xx responses are retried here; 429s are left to
+    RateLimitedSpotify so Retry-After applies to all threads.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                status=3,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504),
+                # 429s must reach RateLimitedSpotify, not be slept on per thread
+                respect_retry_after_header=False,
+                # Hand the last response back so the real status is raised
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=SPOTIFY_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+class RequestCoalescer:
+    """
+    Single-flight for identical requests: while a request is in flight, the
+    same request from any other thread waits for it and gets the same parsed
+    response instead of going to Spotify. Failures are not shared: waiters
+    whose leader failed try again, with one of them leading.
+
+    Responses are shared objects, so callers must not modify them.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+
+    def call(self, key, fn):
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = {'done': threading.Event(), 'ok': False, 'result': None}
+                self.requests += 1
+
+        if leader:
+            try:
+                flight['result'] = fn()
+                flight['ok'] = True
+                return flight['result']
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                flight['done'].set()
+
+        flight['done'].wait()
+        if not flight['ok']:
+            return self.call(key, fn)
+        with self._lock:
+            self.coalesced += 1
+        return flight['result']
+
+    def stats(self):
+        with self._lock:
+            total = self.requests + self.coalesced
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'coalesced_ratio': round(self.coalesced / total, 3) if total else 0,
+            }
+
+
+request_coalescer = RequestCoalescer()
+
+
+class RateLimitedSpotify(spotipy.Spotify):
+    """
+    spotipy client that shares the process-wide session and rate limiter,
+    uses a per-call timeout, and waits out 429 responses for as long as
+    their Retry-After header asks. Every request is counted in
+    `call_counter`. Identical concurrent catalogue reads (COALESCED_ENDPOINTS)
+    share one request through `request_coalescer`, only between clients with
+    the same token where the response depends on it; only the client that
+    made it counts it.
+    """
+
+    def __init__(self, *args, rate_limiter=rate_limiter, call_counter=None,
+                 request_coalescer=request_coalescer if SPOTIFY_COALESCE_REQUESTS else None, **kwargs):
+        kwargs.setdefault('requests_session', get_session())
+        kwargs.setdefault('requests_timeout', SPOTIFY_TIMEOUT)
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+        self.call_counter = call_counter or CallCounter()
+        self.request_coalescer = request_coalescer
+
+    def __del__(self):
+        # The session is shared, so it must outlive any single client
+        pass
+
+    def _internal_call(self, method, url, payload, params):
+        endpoint = endpoint_name(method, url)
+        if self.request_coalescer is None or endpoint not in COALESCED_ENDPOINTS:
+            return self._call_with_retries(method, url, payload, params)
+
+        key = (method, url, tuple(sorted((name, str(value))
+                                         for name, value in params.items() if value is not None)))
+        if endpoint in TOKEN_SCOPED_ENDPOINTS or (
+                endpoint in MARKET_SCOPED_ENDPOINTS and not (params.get('market') or params.get('country'))):
+            # The response depends on who asks, so only share it with the same token
+            key += (self._auth_headers().get('Authorization'),)
+        return self.request_coalescer.call(
+            key, lambda: self._call_with_retries(method, url, payload, params))
+
+    def _call_with_retries(self, method, url, payload, params):
+        for attempt in range(SPOTIFY_MAX_RATE_LIMIT_RETRIES + 1):
+            self.call_counter.record(method, url)
+            self.rate_limiter.acquire()
+            try:
+                # spotipy pops keys from params, so every attempt gets a copy
+                return super()._internal_call(method, url, payload, dict(params))
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == SPOTIFY_MAX_RATE_LIMIT_RETRIES:
+                    raise
+                try:
+                    retry_after = float((e.headers or {}).get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1
+                log(f"Spotify rate limit hit on {method} {url}; pausing all requests for {retry_after}s")
+                self.rate_limiter.pause(retry_after)
+
+
+def create_spotify_client(access_token=None, auth_manager=None, call_budget=None, **kwargs) -> RateLimitedSpotify:
+    """
+    Create a Spotify client that goes through the shared session and rate
+    limiter. With `call_budget`, the client fails once it has made that many
+    requests (see CallCounter).
+    """
+    return RateLimitedSpotify(auth=access_token, auth_manager=auth_manager,
+                              call_counter=CallCounter(call_budget), **kwargs)